@@ -21,25 +21,423 @@ if sys.version_info[0] < 3:
     range = xrange
 
 
+#----------------------------------------------------------------------
+# geometry: 棋盘几何，构造时按照尺寸生成直线和位置权值等表格
+# 直线编号：行 0..N-1，列 N..2N-1，左斜 2N..4N-2（列减行加 3N-1），
+# 右斜 4N-1..6N-3（行加列加 4N-1）；15 路时和原来的编号相同
+#----------------------------------------------------------------------
+class geometry (object):
+
+    def __init__ (self, size = 15):
+        N = size
+        self.size = N
+        self.center = N // 2
+        self.cells = N * N
+        self.nslots = 6 * N - 2
+        self.LEFT = 3 * N - 1       # 左斜线编号的偏移
+        self.RIGHT = 4 * N - 1      # 右斜线编号的偏移
+        # 位置权值：中心最大，往外一格减一，最外圈是 0
+        c = self.center
+        self.POS = tuple([ tuple([ (c - max(abs(i - c), abs(j - c))) 
+            for j in range(N) ]) for i in range(N) ])
+        # 所有长度不小于五的直线：(方向, 格子坐标, 是否倒序分析, 查表标记, 
+        # 直线编号)，分析顺序和逐行扫描棋盘的顺序一致，右斜线从下标大的一端开始
+        self.LINES = []
+        self.SHORTS = []            # 不足五格的斜线
+        for i in range(N):
+            self.__addline(0, i, [ (i, j) for j in range(N) ], 0)
+        for j in range(N):
+            self.__addline(1, N + j, [ (i, j) for i in range(N) ], 0)
+        for d in range(1 - N, N):
+            y, x = d < 0 and (-d, 0) or (0, d)
+            cells = [ (y + k, x + k) for k in range(N - abs(d)) ]
+            self.__addline(2, self.LEFT + d, cells, 0)
+        for s in range(2 * N - 1):
+            x, y = s > N - 1 and (s - N + 1, N - 1) or (0, s)
+            cells = [ (y - k, x + k) for k in range(N - abs(s - N + 1)) ]
+            self.__addline(3, self.RIGHT + s, cells, 1)
+        self.LINES = tuple(self.LINES)
+        self.SHORTS = tuple(self.SHORTS)
+        # 每个格子四个方向：(直线编号, 位移)
+        slots = []
+        for i in range(N):
+            for j in range(N):
+                s = i + j
+                slots.append(((i, j * 2), (N + j, i * 2), 
+                    (self.LEFT + j - i, min(i, j) * 2), 
+                    (self.RIGHT + s, (j - max(0, s - N + 1)) * 2)))
+        self.SLOTS = tuple(slots)
+        self.LETTERS = ''.join([ chr(ord('A') + n) for n in range(N) ])
+        # 8 种对称变换：SYMMETRY[t][格子编号] -> 变换后的格子编号
+        # t & 4 行列互换，t & 2 上下翻转，t & 1 左右翻转（和 openbook 相同）
+        symmetry = []
+        for t in range(8):
+            table = []
+            for k in range(N * N):
+                i, j = k // N, k % N
+                if t & 4:
+                    i, j = j, i
+                if t & 2:
+                    i = N - 1 - i
+                if t & 1:
+                    j = N - 1 - j
+                table.append(i * N + j)
+            symmetry.append(tuple(table))
+        self.SYMMETRY = tuple(symmetry)
+        # 逆变换：INVERSE[t][SYMMETRY[t][k]] == k
+        inverse = []
+        for table in symmetry:
+            data = [ 0 ] * (N * N)
+            for k in range(N * N):
+                data[table[k]] = k
+            inverse.append(tuple(data))
+        self.INVERSE = tuple(inverse)
+        self.MASK = 0           # 每格取低位的掩码
+        for k in range(N):
+            self.MASK |= 1 << (k * 2)
+
+    def __addline (self, direction, slot, cells, reverse):
+        if len(cells) >= 5:
+            tag = (len(cells) << 1) | reverse
+            self.LINES.append((direction, tuple(cells), reverse, tag, slot))
+        else:
+            self.SHORTS.append((direction, tuple(cells)))
+        return 0
+
+
+# 每种尺寸共享一个 geometry
+def shared_geometry (size = 15):
+    data = _geometries.get(size)
+    if data is None:
+        if size < 5 or size > 26:
+            raise ValueError('board size must be between 5 and 26')
+        data = _geometries[size] = geometry(size)
+    return data
+
+_geometries = {}
+
+
+#----------------------------------------------------------------------
+# ruleset: 规则。freestyle: 五子或者更多连珠获胜；standard: 恰好五子获胜；
+# renju: 黑棋恰好五子获胜，并且禁止长连、双四、双三，白棋五子或者更多获胜
+#----------------------------------------------------------------------
+class ruleset (object):
+
+    NAMES = ('freestyle', 'standard', 'renju')
+
+    def __init__ (self, name = 'freestyle'):
+        if name not in self.NAMES:
+            raise ValueError('unknown rule set: %s'%name)
+        self.name = name
+        # exact[棋子]：是否必须恰好五子才获胜
+        self.exact = (False, name != 'freestyle', name == 'standard')
+        self.renju = (name == 'renju')
+
+    # stone 方连成 length 子是否获胜
+    def wins (self, stone, length):
+        if self.exact[stone]:
+            return length == 5
+        return length >= 5
+
+    # 黑棋在空位 (row, col) 落子是否是禁手（长连、双四、双三），见 renju
+    # key 为当前局面的 zobrist 哈希时缓存结果
+    def forbidden (self, board, row, col, key = None):
+        if not self.renju:
+            return False
+        return shared_renju(len(board)).forbidden(board, row, col, key)
+
+
+# 每种规则共享一个 ruleset
+def shared_ruleset (name = 'freestyle'):
+    data = _rulesets.get(name)
+    if data is None:
+        data = _rulesets[name] = ruleset(name)
+    return data
+
+_rulesets = {}
+
+
+#----------------------------------------------------------------------
+# renju: 黑棋禁手检测（长连、双四、双三），恰好五连不算禁手
+# 每条直线单独分析落子后的变化：能走成恰好五连的空格算作四（同一直线上
+# 两个不相连的四，如 X.XXX.X，算两个），能走成活四的空格算作三；有两个
+# 以上的三时，递归检查这些空格本身是否禁手。每条直线的结果按照（直线编码,
+# 落子位置）缓存，每个局面的结果按照哈希缓存
+#----------------------------------------------------------------------
+class renju (object):
+
+    # 直线上的棋型变化
+    NONE, THREE, FOUR, OVERLINE, FIVE = 0, 1, 2, 3, 4
+
+    def __init__ (self, size = 15, limit = 1 << 16):
+        geo = shared_geometry(size)
+        self.size = size
+        self.limit = limit          # 缓存表项上限，超过时清空
+        self.cache = {}             # 局面哈希 -> { 格子编号: 是否禁手 }
+        self.kinds = {}             # (直线编码, 查表标记, 位移) -> 棋型变化
+        self.checks = 0             # 检测次数
+        self.hits = 0               # 局面缓存命中次数
+        # 每个格子：((直线编号, 位移, 查表标记), ...)，不足五格的直线忽略
+        self.cells = {}             # 直线编号 -> 格子坐标
+        tags = {}
+        for direction, cells, reverse, tag, slot in geo.LINES:
+            tags[slot] = tag
+            self.cells[slot] = cells
+        self.lines = []
+        for slots in geo.SLOTS:
+            self.lines.append(tuple([ (slot, shift, tags[slot]) 
+                for slot, shift in slots if slot in tags ]))
+
+    def reset (self):
+        self.cache.clear()
+        self.checks = 0
+        self.hits = 0
+        return 0
+
+    # 黑棋在空位 (row, col) 落子是否是禁手。board 是 bitboard 时直接使用
+    # 它的直线编码；key 为当前局面的哈希时缓存结果
+    def forbidden (self, board, row, col, key = None):
+        self.checks += 1
+        index = row * self.size + col
+        entry = None
+        if key is not None:
+            entry = self.cache.get(key)
+            if entry is None:
+                if len(self.cache) >= self.limit:
+                    self.cache.clear()
+                entry = self.cache[key] = {}
+            else:
+                result = entry.get(index)
+                if result is not None:
+                    self.hits += 1
+                    return result
+        result = False
+        if board[row][col] == 0:
+            result = self.__forbidden(board, row, col)
+        if entry is not None:
+            entry[index] = result
+        return result
+
+    # 去掉禁手：moves 是 (分数, 行, 列) 列表
+    def filter (self, board, moves, key = None):
+        forbidden = self.forbidden
+        return [ m for m in moves if not forbidden(board, m[1], m[2], key) ]
+
+    # 不使用局面缓存的判断：活三要能走成活四，并且那一步本身不是禁手
+    def __forbidden (self, board, row, col):
+        codes = getattr(board, 'codes', None)
+        kinds = self.kinds
+        fours, overline, threes = 0, False, []
+        for slot, shift, tag in self.lines[row * self.size + col]:
+            if codes is not None:
+                code = codes[slot]
+            else:
+                code = self.__code(board, slot)
+            mk = (((code << 6) | tag) << 6) | shift
+            kind = kinds.get(mk)
+            if kind is None:
+                kind = self.__kind(code, tag >> 1, shift >> 1)
+                if len(kinds) >= self.limit:
+                    kinds.clear()
+                kinds[mk] = kind
+            if kind[0] == 4:
+                return False
+            elif kind[0] == 3:
+                overline = True
+            elif kind[0] == 2:
+                fours += kind[1]
+            elif kind[0] == 1:
+                threes.append((slot, kind[1]))
+        if overline or fours >= 2:
+            return True
+        if len(threes) < 2:
+            return False
+        count = 0
+        board[row][col] = 1
+        try:
+            for slot, points in threes:
+                cells = self.cells[slot]
+                for k in points:
+                    y, x = cells[k]
+                    if not self.__forbidden(board, y, x):
+                        count += 1
+                        break
+        finally:
+            board[row][col] = 0
+        return count >= 2
+
+    def __code (self, board, slot):
+        code, shift = 0, 0
+        for y, x in self.cells[slot]:
+            code |= board[y][x] << shift
+            shift += 2
+        return code
+
+    # 直线上经过第 pos 格的黑棋连续段：返回两端的格子
+    def __span (self, code, num, pos):
+        head, tail = pos, pos
+        while head > 0 and (code >> ((head - 1) * 2)) & 3 == 1:
+            head -= 1
+        while tail < num - 1 and (code >> ((tail + 1) * 2)) & 3 == 1:
+            tail += 1
+        return head, tail
+
+    # 一条直线上黑棋在第 pos 格落子的棋型变化：(FIVE/OVERLINE, 0)，
+    # (FOUR, 四的个数)，(THREE, 能走成活四的空格) 或者 (NONE, 0)
+    def __kind (self, code, num, pos):
+        after = code | (1 << (pos * 2))
+        head, tail = self.__span(after, num, pos)
+        if tail - head == 4:
+            return (self.FIVE, 0)
+        if tail - head > 4:
+            return (self.OVERLINE, 0)
+        empty = [ k for k in range(max(0, pos - 4), min(num, pos + 5)) 
+                if (after >> (k * 2)) & 3 == 0 ]
+        # 四：落子以后能走成恰好五连的空格，活四的两端只算一个四
+        points = []
+        for k in empty:
+            head, tail = self.__span(after | (1 << (k * 2)), num, pos)
+            if tail - head == 4:
+                points.append(k)
+        if points:
+            fours = len(points)
+            for n in range(1, len(points)):
+                if points[n] - points[n - 1] == 5:
+                    fours -= 1
+            return (self.FOUR, fours)
+        # 三：落子以后能走成活四（两端都能走成恰好五连）的空格
+        def cell (k):       # 直线以外算作对方棋子
+            if k < 0 or k >= num:
+                return 2
+            return (after >> (k * 2)) & 3
+        points = []
+        for k in empty:
+            head, tail = self.__span(after | (1 << (k * 2)), num, pos)
+            if tail - head == 3 and cell(head - 1) == 0 and \
+                    cell(tail + 1) == 0 and cell(head - 2) != 1 and \
+                    cell(tail + 2) != 1:
+                points.append(k)
+        if points:
+            return (self.THREE, tuple(points))
+        return (self.NONE, 0)
+
+
+# 每种尺寸共享一个 renju
+def shared_renju (size = 15):
+    data = _renjus.get(size)
+    if data is None:
+        data = _renjus[size] = renju(size)
+    return data
+
+_renjus = {}
+
+
 #----------------------------------------------------------------------
 # chessboard: 棋盘类，简单从字符串加载棋局或者导出字符串，判断输赢等
 #----------------------------------------------------------------------
 class chessboard (object):
 
-    def __init__ (self, forbidden = 0):
-        self.__board = [ [ 0 for n in range(15) ] for m in range(15) ]
-        self.__forbidden = forbidden
+    # size: 棋盘尺寸；rules: 规则名称或者 ruleset，forbidden 为真时默认 renju
+    def __init__ (self, forbidden = 0, size = 15, rules = None):
+        if rules is None:
+            rules = forbidden and 'renju' or 'freestyle'
+        if not isinstance(rules, ruleset):
+            rules = shared_ruleset(rules)
+        self.geometry = shared_geometry(size)
+        self.size = size
+        self.rules = rules
+        self.__board = [ [ 0 for n in range(size) ] for m in range(size) ]
+        self.__forbidden = rules.renju
         self.__dirs = ( (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), \
             (1, -1), (0, -1), (-1, -1) )
         self.DIRS = self.__dirs
         self.won = {}
+        # make_move/unmake_move 维护的走子记录和派生数据
+        import array
+        self.zobrist = shared_zobrist(size)
+        self.hash = 0
+        self.stack = array.array('H')       # 每步：(行 * 尺寸 + 列) * 4 + 棋子
+        self.evaluator = None       # 需要同步的增量评估 incremental
+        self.candidate = None       # 需要同步的候选点 candidate
     
     # 清空棋盘
     def reset (self):
-        for j in range(15):
-            for i in range(15):
-                self.__board[i][j] = 0
+        for row in self.__board:
+            for j in range(self.size):
+                row[j] = 0
+        self.won = {}
+        self.hash = 0
+        del self.stack[:]
+        if self.evaluator is not None:
+            self.evaluator.reset()
+        if self.candidate is not None:
+            self.candidate.reset()
+        return 0
+
+    # 接管外部的棋盘数组（例如 searcher.board），并设置落子时需要同步的
+    # 增量评估和候选点，然后重新计算派生数据
+    def bind (self, board = None, evaluator = None, candidate = None):
+        if board is not None:
+            self.__board = board
+        self.evaluator = evaluator
+        self.candidate = candidate
+        return self.sync()
+
+    # 棋盘被直接修改以后（put，loads 或者写数组）重新计算哈希，清空走子
+    # 记录，重新加载增量评估和候选点
+    def sync (self):
+        self.hash = self.zobrist.hash(self.__board)
+        del self.stack[:]
+        if self.evaluator is not None:
+            self.evaluator.load(self.__board)
+        if self.candidate is not None:
+            self.candidate.load(self.__board)
+        return 0
+
+    # 落子并记录，同步哈希、增量评估和候选点
+    def make_move (self, row, col, stone):
+        self.__board[row][col] = stone
+        self.hash ^= self.zobrist.table[stone][row][col]
+        self.stack.append(((row * self.size + col) << 2) | stone)
+        candidate, evaluator = self.candidate, self.evaluator
+        if candidate is not None:
+            candidate.place(row, col)
+        if evaluator is not None:
+            evaluator.apply(row, col, stone)
         return 0
+
+    # 撤销最后一步，返回 (row, col, stone)
+    def unmake_move (self):
+        code = self.stack.pop()
+        stone = code & 3
+        row, col = divmod(code >> 2, self.size)
+        self.__board[row][col] = 0
+        self.hash ^= self.zobrist.table[stone][row][col]
+        candidate, evaluator = self.candidate, self.evaluator
+        if candidate is not None:
+            candidate.remove(row, col)
+        if evaluator is not None:
+            evaluator.undo(row, col)
+        if self.won:
+            self.won = {}
+        return row, col, stone
+
+    # 最后一步，没有则返回 None
+    def lastmove (self):
+        if not self.stack:
+            return None
+        return divmod(self.stack[-1] >> 2, self.size)
+
+    # 最后一步是否连成五子（按照规则），返回获胜的棋子或者 0。只检查经过
+    # 最后一步的直线，不检查禁手（见 checkmove）
+    def winner (self):
+        if not self.stack:
+            return 0
+        code = self.stack[-1]
+        row, col = divmod(code >> 2, self.size)
+        if fiveline(self.__board, row, col, self.rules) is None:
+            return 0
+        return code & 3
     
     # 索引器
     def __getitem__ (self, row):
@@ -47,14 +445,14 @@ class chessboard (object):
 
     # 将棋盘转换成字符串
     def __str__ (self):
-        text = '  A B C D E F G H I J K L M N O\n'
+        text = '  ' + ' '.join(self.geometry.LETTERS) + '\n'
         mark = ('. ', 'O ', 'X ')
         nrow = 0
         for row in self.__board:
             line = ''.join([ mark[n] for n in row ])
             text += chr(ord('A') + nrow) + ' ' + line
             nrow += 1
-            if nrow < 15: text += '\n'
+            if nrow < self.size: text += '\n'
         return text
     
     # 转成字符串
@@ -62,32 +460,40 @@ class chessboard (object):
         return self.__str__()
 
     def get (self, row, col):
-        if row < 0 or row >= 15 or col < 0 or col >= 15:
+        if row < 0 or row >= self.size or col < 0 or col >= self.size:
             return 0
         return self.__board[row][col]
 
     def put (self, row, col, x):
-        if row >= 0 and row < 15 and col >= 0 and col < 15:
+        if row >= 0 and row < self.size and col >= 0 and col < self.size:
             self.__board[row][col] = x
         return 0
     
     # 判断输赢，返回0（无输赢），1（白棋赢），2（黑棋赢）
-    def check (self):
+    # 从每段连珠的起点数整段长度，是否获胜由规则决定（长连是否算赢）
+    # last 为最后一步的坐标时，连珠规则下黑棋走了禁手判负
+    def check (self, last = None):
         board = self.__board
+        if last is not None and self.__foul(last[0], last[1]):
+            return 2
         dirs = ((1, -1), (1, 0), (1, 1), (0, 1))
-        for i in range(15):
-            for j in range(15):
+        wins = self.rules.wins
+        N = self.size
+        for i in range(N):
+            for j in range(N):
                 if board[i][j] == 0: continue
                 id = board[i][j]
                 for d in dirs:
-                    x, y = j, i
+                    y, x = i - d[0], j - d[1]
+                    if 0 <= y < N and 0 <= x < N and board[y][x] == id:
+                        continue
+                    y, x = i, j
                     count = 0
-                    for k in range(5):
-                        if self.get(y, x) != id: break
+                    while 0 <= y < N and 0 <= x < N and board[y][x] == id:
                         y += d[0]
                         x += d[1]
                         count += 1
-                    if count == 5:
+                    if count >= 5 and wins(id, count):
                         self.won = {}
                         r, c = i, j
                         for z in range(5):
@@ -96,7 +502,33 @@ class chessboard (object):
                             c += d[1]
                         return id
         return 0
+
+    # 只检查经过最后一步 (row, col) 的四条直线，返回值和 check() 相同
+    def checkmove (self, row, col):
+        if self.__foul(row, col):
+            return 2
+        line = fiveline(self.__board, row, col, self.rules)
+        if line is None:
+            return 0
+        self.won = {}
+        for cell in line:
+            self.won[cell] = 1
+        return self.__board[row][col]
     
+    # 连珠规则下 (row, col) 的黑子是否是禁手，是则标记为胜负点
+    def __foul (self, row, col):
+        board = self.__board
+        if not self.rules.renju or board[row][col] != 1:
+            return False
+        board[row][col] = 0
+        try:
+            foul = self.rules.forbidden(board, row, col)
+        finally:
+            board[row][col] = 1
+        if foul:
+            self.won = { (row, col): 1 }
+        return foul
+
     # 返回数组对象
     def board (self):
         return self.__board
@@ -106,8 +538,8 @@ class chessboard (object):
         import io
         sio = io.StringIO()
         board = self.__board
-        for i in range(15):
-            for j in range(15):
+        for i in range(self.size):
+            for j in range(self.size):
                 stone = board[i][j]
                 if stone != 0:
                     ti = chr(ord('A') + i)
@@ -118,7 +550,6 @@ class chessboard (object):
     # 从字符串加载棋局
     def loads (self, text):
         self.reset()
-        board = self.__board
         for item in text.strip('\r\n\t ').replace(',', ' ').split(' '):
             n = item.strip('\r\n\t ')
             if not n: continue
@@ -126,7 +557,8 @@ class chessboard (object):
             stone = int(n[0])
             i = ord(n[1][0].upper()) - ord('A')
             j = ord(n[1][1].upper()) - ord('A')
-            board[i][j] = stone
+            self.put(i, j, stone)
+        self.sync()
         return 0
 
     # 设置终端颜色
@@ -170,15 +602,14 @@ class chessboard (object):
     
     # 彩色输出
     def show (self):
-        print('  A B C D E F G H I J K L M N O')
+        print('  ' + ' '.join(self.geometry.LETTERS))
         mark = ('. ', 'O ', 'X ')
         nrow = 0
-        self.check()
         color1 = 10
         color2 = 13
-        for row in range(15):
+        for row in range(self.size):
             print(chr(ord('A') + row), end='')
-            for col in range(15):
+            for col in range(self.size):
                 ch = self.__board[row][col]
                 if ch == 0: 
                     self.console(-1)
@@ -202,17 +633,137 @@ class chessboard (object):
         return 0
 
 
+# 经过 (row, col) 的五连：返回五个格子的坐标（和 check() 一样从扫描顺序
+# 靠前的一端开始），没有则返回 None。rules 为 None 时五子以上都算
+def fiveline (board, row, col, rules = None):
+    stone = board[row][col]
+    if stone == 0:
+        return None
+    N = len(board)
+    for dy, dx in ((1, -1), (1, 0), (1, 1), (0, 1)):
+        y, x = row - dy, col - dx
+        while 0 <= y < N and 0 <= x < N and board[y][x] == stone:
+            y, x = y - dy, x - dx
+        y, x = y + dy, x + dx
+        count = 0
+        while 0 <= y + dy * count < N and 0 <= x + dx * count < N and \
+                board[y + dy * count][x + dx * count] == stone:
+            count += 1
+        if count >= 5 and (rules is None or rules.wins(stone, count)):
+            return [ (y + dy * k, x + dx * k) for k in range(5) ]
+    return None
+
+
+#----------------------------------------------------------------------
+# bitboard: 位棋盘，每条直线用一个整数保存，每格 2 位（黑棋 1，白棋 2）
+# 直线编号见 geometry，15 路时：行 0-14，列 15-29，左斜 30-58（列减行加 44），
+# 右斜 59-87（行加列加 59）
+#----------------------------------------------------------------------
+class bitboard (chessboard):
+
+    def __init__ (self, forbidden = 0, size = 15, rules = None):
+        geo = shared_geometry(size)
+        self.codes = [ 0 for n in range(geo.nslots) ]
+        self.slots = geo.SLOTS      # 每个格子四个方向：(直线编号, 位移)
+        self.MASK = geo.MASK
+        chessboard.__init__(self, forbidden, size, rules)
+        self.rows = [ bitrow(self, i) for i in range(size) ]
+
+    # 清空棋盘
+    def reset (self):
+        chessboard.reset(self)
+        codes = self.codes
+        for i in range(len(codes)):
+            codes[i] = 0
+        return 0
+
+    # 索引器：写入时同时更新直线编码
+    def __getitem__ (self, row):
+        return self.rows[row]
+
+    def put (self, row, col, x):
+        N = self.size
+        if row >= 0 and row < N and col >= 0 and col < N:
+            self.board()[row][col] = x
+            codes = self.codes
+            for slot, shift in self.slots[row * N + col]:
+                codes[slot] = (codes[slot] & ~(3 << shift)) | (x << shift)
+        return 0
+
+    # bind 换了数组或者直接写了数组以后：重新建立行代理和直线编码
+    def sync (self):
+        board, N = self.board(), self.size
+        self.rows = [ bitrow(self, i) for i in range(N) ]
+        codes, slots = self.codes, self.slots
+        for i in range(len(codes)):
+            codes[i] = 0
+        for i in range(N):
+            row = board[i]
+            for j in range(N):
+                stone = row[j]
+                if stone:
+                    for slot, shift in slots[i * N + j]:
+                        codes[slot] |= stone << shift
+        return chessboard.sync(self)
+
+    # 走子记录同样需要更新直线编码
+    def make_move (self, row, col, stone):
+        chessboard.make_move(self, row, col, stone)
+        codes = self.codes
+        for slot, shift in self.slots[row * self.size + col]:
+            codes[slot] |= stone << shift
+        return 0
+
+    def unmake_move (self):
+        row, col, stone = chessboard.unmake_move(self)
+        codes = self.codes
+        for slot, shift in self.slots[row * self.size + col]:
+            codes[slot] &= ~(3 << shift)
+        return row, col, stone
+
+    # 某条直线上某种棋子的位图：第 k 格有该棋子则第 2k 位为 1
+    def mask (self, slot, stone):
+        return (self.codes[slot] >> (stone - 1)) & self.MASK
+
+
+# bitboard 的行：读取直接返回，写入通过 bitboard.put
+class bitrow (object):
+
+    def __init__ (self, owner, row):
+        self.owner = owner
+        self.row = row
+        self.data = owner.board()[row]
+
+    def __getitem__ (self, col):
+        return self.data[col]
+
+    def __setitem__ (self, col, x):
+        self.owner.put(self.row, col, x)
+
+    def __len__ (self):
+        return len(self.data)
+
+    def __iter__ (self):
+        return iter(self.data)
+
+
 #----------------------------------------------------------------------
 # evaluation: 棋盘评估类，给当前棋盘打分用
 #----------------------------------------------------------------------
 class evaluation (object):
 
-    def __init__ (self):
-        self.POS = []
-        for i in range(15):
-            row = [ (7 - max(abs(i - 7), abs(j - 7))) for j in range(15) ]
-            self.POS.append(tuple(row))
-        self.POS = tuple(self.POS)
+    # patterns: 直线棋型表，True 使用共享的表，None 则逐个棋子分析
+    # size: 棋盘尺寸，直线和位置权值等表格取自对应的 geometry
+    # rules: 规则名称或者 ruleset，必须恰好五子获胜的一方长连不算五连
+    def __init__ (self, patterns = True, size = 15, rules = None):
+        if not isinstance(rules, ruleset):
+            rules = shared_ruleset(rules or 'freestyle')
+        geo = shared_geometry(size)
+        self.size = size
+        self.rules = rules
+        self.exact = rules.exact
+        self.geometry = geo
+        self.POS = geo.POS
         self.STWO = 1       # 冲二
         self.STHREE = 2     # 冲三
         self.SFOUR = 3      # 冲四
@@ -226,31 +777,38 @@ class evaluation (object):
         self.NOTYPE = 11    
         self.ANALYSED = 255     # 已经分析过
         self.TODO = 0           # 没有分析过
+        self.CHECK = {}         # 需要计数的棋型
+        for c in (self.FIVE, self.FOUR, self.SFOUR, self.THREE, self.STHREE,
+                self.TWO, self.STWO):
+            self.CHECK[c] = 1
         self.result = [ 0 for i in range(30) ]     # 保存当前直线分析值
         self.line = [ 0 for i in range(30) ]       # 当前直线数据
         self.record = []            # 全盘分析结果 [row][col][方向]
-        for i in range(15):
-            self.record.append([])
-            self.record[i] = []
-            for j in range(15):
-                self.record[i].append([ 0, 0, 0, 0])
+        for i in range(size):
+            self.record.append([ [ 0, 0, 0, 0 ] for j in range(size) ])
         self.count = []             # 每种棋局的个数：count[黑棋/白棋][模式]
         for i in range(3):
             data = [ 0 for i in range(20) ]
             self.count.append(data)
+        # 所有长度不小于五的直线和不足五格的斜线，见 geometry
+        self.LINES = geo.LINES
+        self.SHORTS = geo.SHORTS
+        if patterns is True:
+            patterns = shared_linetable(rules.name)
+        self.patterns = patterns or None
+        self.stats = None           # 搜索统计 statistics，None 则不记录
         self.reset()
 
     # 复位数据
     def reset (self):
         TODO = self.TODO
         count = self.count
-        for i in range(15):
-            line = self.record[i]
-            for j in range(15):
-                line[j][0] = TODO
-                line[j][1] = TODO
-                line[j][2] = TODO
-                line[j][3] = TODO
+        for line in self.record:
+            for cell in line:
+                cell[0] = TODO
+                cell[1] = TODO
+                cell[2] = TODO
+                cell[3] = TODO
         for i in range(20):
             count[0][i] = 0
             count[1][i] = 0
@@ -259,8 +817,19 @@ class evaluation (object):
 
     # 四个方向（水平，垂直，左斜，右斜）分析评估棋盘，然后根据分析结果打分
     def evaluate (self, board, turn):
+        stats = self.stats
+        if stats is not None:
+            t = stats.clock()
+            score = self.__evaluate(board, turn)
+            score = self.adjust(score, self.count, turn)
+            stats.evaluations += 1
+            stats.evaltime += stats.clock() - t
+            return score
         score = self.__evaluate(board, turn)
-        count = self.count
+        return self.adjust(score, self.count, turn)
+
+    # 胜负已分时，根据棋型种类微调分数
+    def adjust (self, score, count, turn):
         if score < -9000:
             stone = turn == 1 and 2 or 1
             for i in range(20):
@@ -278,37 +847,61 @@ class evaluation (object):
         record, count = self.record, self.count
         TODO, ANALYSED = self.TODO, self.ANALYSED
         self.reset()
-        # 四个方向分析
-        for i in range(15):
-            boardrow = board[i]
-            recordrow = record[i]
-            for j in range(15):
-                if boardrow[j] != 0:
-                    if recordrow[j][0] == TODO:     # 水平没有分析过？
-                        self.__analysis_horizon(board, i, j)
-                    if recordrow[j][1] == TODO:     # 垂直没有分析过？
-                        self.__analysis_vertical(board, i, j)
-                    if recordrow[j][2] == TODO:     # 左斜没有分析过？
-                        self.__analysis_left(board, i, j)
-                    if recordrow[j][3] == TODO:     # 右斜没有分析过
-                        self.__analysis_right(board, i, j)
+        stats = self.stats
+        N = self.size
+        if stats is not None:
+            t = stats.clock()
+        if self.patterns is not None:
+            self.__analysis_table(board)
+        else:
+            # 四个方向分析
+            for i in range(N):
+                boardrow = board[i]
+                recordrow = record[i]
+                for j in range(N):
+                    if boardrow[j] != 0:
+                        if recordrow[j][0] == TODO:     # 水平没有分析过？
+                            self.__analysis_horizon(board, i, j)
+                        if recordrow[j][1] == TODO:     # 垂直没有分析过？
+                            self.__analysis_vertical(board, i, j)
+                        if recordrow[j][2] == TODO:     # 左斜没有分析过？
+                            self.__analysis_left(board, i, j)
+                        if recordrow[j][3] == TODO:     # 右斜没有分析过
+                            self.__analysis_right(board, i, j)
 
-        FIVE, FOUR, THREE, TWO = self.FIVE, self.FOUR, self.THREE, self.TWO
-        SFOUR, STHREE, STWO = self.SFOUR, self.STHREE, self.STWO
-        check = {}
+            check = self.CHECK
+
+            # 分别对白棋黑棋计算：FIVE, FOUR, THREE, TWO等出现的次数
+            for i in range(N):
+                for j in range(N):
+                    stone = board[i][j]
+                    if stone != 0:
+                        for k in range(4):
+                            ch = record[i][j][k]
+                            if ch in check:
+                                count[stone][ch] += 1
+        if stats is not None:
+            stats.analysistime += stats.clock() - t
+        BLACK, WHITE = 1, 2
 
-        # 分别对白棋黑棋计算：FIVE, FOUR, THREE, TWO等出现的次数
-        for c in (FIVE, FOUR, SFOUR, THREE, STHREE, TWO, STWO):
-            check[c] = 1
-        for i in range(15):
-            for j in range(15):
+        # 加上位置权值，棋盘最中心点权值最大（15 路是 7），往外一格-1，最外圈是0
+        wc, bc = 0, 0
+        for i in range(N):
+            for j in range(N):
                 stone = board[i][j]
                 if stone != 0:
-                    for k in range(4):
-                        ch = record[i][j][k]
-                        if ch in check:
-                            count[stone][ch] += 1
-        
+                    if stone == WHITE:
+                        wc += self.POS[i][j]
+                    else:
+                        bc += self.POS[i][j]
+
+        return self.rate(count, turn, wc, bc)
+
+    # 根据棋型计数 count[黑棋/白棋][模式] 和双方位置权值 (wc, bc) 打分
+    def rate (self, count, turn, wc, bc):
+        FIVE, FOUR, THREE, TWO = self.FIVE, self.FOUR, self.THREE, self.TWO
+        SFOUR, STHREE, STWO = self.SFOUR, self.STHREE, self.STWO
+
         # 如果有五连则马上返回分数
         BLACK, WHITE = 1, 2
         if turn == WHITE:           # 当前是白棋
@@ -397,16 +990,6 @@ class evaluation (object):
             if count[WHITE][STWO]:
                 wvalue += count[WHITE][STWO]
         
-        # 加上位置权值，棋盘最中心点权值是7，往外一格-1，最外圈是0
-        wc, bc = 0, 0
-        for i in range(15):
-            for j in range(15):
-                stone = board[i][j]
-                if stone != 0:
-                    if stone == WHITE:
-                        wc += self.POS[i][j]
-                    else:
-                        bc += self.POS[i][j]
         wvalue += wc
         bvalue += bc
         
@@ -415,14 +998,51 @@ class evaluation (object):
 
         return bvalue - wvalue
     
+    # 查表分析：每条直线编码以后直接查出分析结果和棋型计数
+    def __analysis_table (self, board):
+        record, count = self.record, self.count
+        patterns = self.patterns
+        table = patterns.table
+        codes = getattr(board, 'codes', None)       # bitboard 直接取直线编码
+        for direction, cells, reverse, tag, slot in self.LINES:
+            if codes is not None:
+                code = codes[slot]
+            else:
+                code, shift = 0, 0
+                for y, x in cells:
+                    code |= board[y][x] << shift
+                    shift += 2
+            if code == 0:
+                continue
+            data = table.get((code << 6) | tag)
+            if data is None:
+                if self.stats is not None:
+                    self.stats.misses += 1
+                data = patterns.lookup(code, len(cells), reverse)
+            k = 0
+            records = data[0]
+            for y, x in cells:
+                record[y][x][direction] = records[k]
+                k += 1
+            for stone, pattern in data[1]:
+                count[stone][pattern] += 1
+        ANALYSED = self.ANALYSED
+        for direction, cells in self.SHORTS:
+            for y, x in cells:
+                if board[y][x]:
+                    for y, x in cells:
+                        record[y][x][direction] = ANALYSED
+                    break
+        return 0
+
     # 分析横向
     def __analysis_horizon (self, board, i, j):
         line, result, record = self.line, self.result, self.record
-        TODO = self.TODO
-        for x in range(15):
+        TODO, N = self.TODO, self.size
+        for x in range(N):
             line[x] = board[i][x]
-        self.analysis_line(line, result, 15, j)
-        for x in range(15):
+        self.analysis_line(line, result, N, j)
+        for x in range(N):
             if result[x] != TODO:
                 record[i][x][0] = result[x]
         return record[i][j][0]
@@ -430,11 +1050,11 @@ class evaluation (object):
     # 分析横向
     def __analysis_vertical (self, board, i, j):
         line, result, record = self.line, self.result, self.record
-        TODO = self.TODO
-        for x in range(15):
+        TODO, N = self.TODO, self.size
+        for x in range(N):
             line[x] = board[x][j]
-        self.analysis_line(line, result, 15, i)
-        for x in range(15):
+        self.analysis_line(line, result, N, i)
+        for x in range(N):
             if result[x] != TODO:
                 record[x][j][1] = result[x]
         return record[i][j][1]
@@ -442,12 +1062,12 @@ class evaluation (object):
     # 分析左斜
     def __analysis_left (self, board, i, j):
         line, result, record = self.line, self.result, self.record
-        TODO = self.TODO
+        TODO, N = self.TODO, self.size
         if i < j: x, y = j - i, 0
         else: x, y = 0, i - j
         k = 0
-        while k < 15:
-            if x + k > 14 or y + k > 14:
+        while k < N:
+            if x + k > N - 1 or y + k > N - 1:
                 break
             line[k] = board[y + k][x + k]
             k += 1
@@ -460,12 +1080,12 @@ class evaluation (object):
     # 分析右斜
     def __analysis_right (self, board, i, j):
         line, result, record = self.line, self.result, self.record
-        TODO = self.TODO
-        if 14 - i < j: x, y, realnum = j - 14 + i, 14, 14 - i
+        TODO, N = self.TODO, self.size
+        if N - 1 - i < j: x, y, realnum = j - N + 1 + i, N - 1, N - 1 - i
         else: x, y, realnum = 0, i + j, j
         k = 0
-        while k < 15:
-            if x + k > 14 or y - k < 0:
+        while k < N:
+            if x + k > N - 1 or y - k < 0:
                 break
             line[k] = board[y - k][x + k]
             k += 1
@@ -479,8 +1099,8 @@ class evaluation (object):
         self.reset()
         record = self.record
         TODO = self.TODO
-        for i in range(15):
-            for j in range(15):
+        for i in range(self.size):
+            for j in range(self.size):
                 if board[i][j] != 0 and 1:
                     if self.record[i][j][0] == TODO:
                         self.__analysis_horizon(board, i, j)
@@ -543,8 +1163,10 @@ class evaluation (object):
         
         srange = xr - xl
 
-        # 如果是 5连
+        # 如果是 5连（恰好五子获胜时长连不算）
         if srange >= 4: 
+            if srange > 4 and self.exact[stone]:
+                return 0
             record[pos] = self.FIVE
             return self.FIVE
         
@@ -644,207 +1266,3889 @@ class evaluation (object):
         return 0
     def textrec (self, direction = 0):
         text = []
-        for i in range(15):
+        for i in range(self.size):
             line = ''
-            for j in range(15):
+            for j in range(self.size):
                 line += '%x '%(self.record[i][j][direction] & 0xf)
             text.append(line)
         return '\n'.join(text)
 
 
 #----------------------------------------------------------------------
-# DFS: 博弈树搜索
+# linetable: 直线棋型表，把一条直线（每格 2 位编码）直接映射到分析结果
 #----------------------------------------------------------------------
-class searcher (object):
+class linetable (object):
 
-    # 初始化
-    def __init__ (self):
-        self.evaluator = evaluation()
-        self.board = [ [ 0 for n in range(15) ] for i in range(15) ]
-        self.gameover = 0
-        self.overvalue = 0
-        self.maxdepth = 3
+    MAGIC = 'GBLT'
+    VERSION = 1
 
-    # 产生当前棋局的走法
-    def genmove (self, turn):
-        moves = []
-        board = self.board
-        POSES = self.evaluator.POS
-        for i in range(15):
-            for j in range(15):
-                if board[i][j] == 0:
-                    score = POSES[i][j]
-                    moves.append((score, i, j))
-        moves.sort()
-        moves.reverse()
-        return moves
-    
-    # 递归搜索：返回最佳分数
-    def __search (self, turn, depth, alpha = -0x7fffffff, beta = 0x7fffffff):
+    # eager: 预先生成不超过该长度的所有直线，更长的直线第一次出现时计算
+    # limit: 表项上限，超过时清空重新累积；rules: 规则名称，决定长连是否算五连
+    def __init__ (self, eager = 9, limit = 1 << 18, rules = None):
+        self.reference = evaluation(None, rules = rules)
+        self.eager = eager
+        self.limit = limit
+        self.table = {}     # (code << 6) | (num << 1) | reverse -> 结果
+        self.line = [ 0 for n in range(30) ]
+        self.result = [ 0 for n in range(30) ]
 
-        # 深度为零则评估棋盘并返回
-        if depth <= 0:
-            score = self.evaluator.evaluate(self.board, turn)
-            return score
+    # 按照 evaluation 的顺序分析整条直线，返回 (逐格结果, ((棋子, 棋型), ...))
+    def compute (self, code, num, reverse):
+        ref = self.reference
+        line, result = self.line, self.result
+        TODO = ref.TODO
+        record = [ TODO ] * num
+        for k in range(num):
+            line[k] = (code >> (k * 2)) & 3
+        order = range(num)
+        if reverse:
+            order = range(num - 1, -1, -1)
+        for pos in order:
+            if line[pos] and record[pos] == TODO:
+                ref.analysis_line(line, result, num, pos)
+                for k in range(num):
+                    if result[k] != TODO:
+                        record[k] = result[k]
+        patterns = []
+        for k in range(num):
+            if line[k] and 0 < record[k] < 8:
+                patterns.append((line[k], record[k]))
+        return (tuple(record), tuple(patterns))
 
-        # 如果游戏结束则立马返回
-        score = self.evaluator.evaluate(self.board, turn)
-        if abs(score) >= 9999 and depth < self.maxdepth: 
-            return score
+    # 查表，不存在则计算并加入
+    def lookup (self, code, num, reverse):
+        key = (code << 6) | (num << 1) | reverse
+        data = self.table.get(key)
+        if data is None:
+            data = self.compute(code, num, reverse)
+            if len(self.table) >= self.limit:
+                self.table.clear()
+            self.table[key] = data
+        return data
 
-        # 产生新的走法
-        moves = self.genmove(turn)
-        bestmove = None
+    # 预先生成所有短直线
+    def build (self):
+        import itertools
+        for num in range(5, self.eager + 1):
+            for cells in itertools.product((0, 1, 2), repeat = num):
+                code = 0
+                for k in range(num):
+                    code |= cells[k] << (k * 2)
+                for reverse in (0, 1):
+                    key = (code << 6) | (num << 1) | reverse
+                    self.table[key] = self.compute(code, num, reverse)
+        return len(self.table)
 
-        # 枚举当前所有走法
-        for score, row, col in moves:
+    # 用一组固定直线的分析结果作为指纹，analysis_line 改变以后旧的缓存失效
+    def fingerprint (self):
+        import random, zlib
+        rand = random.Random(15)
+        data = []
+        for i in range(64):
+            num = rand.randint(5, 15)
+            code = 0
+            for k in range(num):
+                code |= rand.choice((0, 0, 1, 2)) << (k * 2)
+            data.append(self.compute(code, num, i & 1))
+        return zlib.crc32(repr(data).encode('utf-8')) & 0xffffffff
 
-            # 标记当前走法到棋盘
-            self.board[row][col] = turn
-            
-            # 计算下一回合该谁走
-            nturn = turn == 1 and 2 or 1
+    # 保存到文件：先写到临时文件再改名，多个进程同时保存时不会留下写了
+    # 一半的文件
+    def save (self, filename):
+        import marshal, os
+        header = (self.MAGIC, self.VERSION, self.fingerprint(), self.eager)
+        temp = '%s.%d'%(filename, os.getpid())
+        try:
+            with open(temp, 'wb') as fp:
+                marshal.dump((header, self.table), fp)
+            os.rename(temp, filename)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        return 0
 
-            # 深度优先搜索，返回评分，走的行和走的列
-            score = - self.__search(nturn, depth - 1, -beta, -alpha)
+    # 复制一份：表格内容相同，之后各自累积（给其他线程使用）
+    def copy (self):
+        table = linetable(self.eager, self.limit, self.reference.rules.name)
+        table.table = dict(self.table)
+        return table
 
-            # 棋盘上清除当前走法
-            self.board[row][col] = 0
+    # 从文件加载，版本或者指纹不符时返回 False
+    def load (self, filename):
+        import marshal
+        try:
+            with open(filename, 'rb') as fp:
+                header, table = marshal.load(fp)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return False
+        if header != (self.MAGIC, self.VERSION, self.fingerprint(), self.eager):
+            return False
+        self.table = table
+        return True
 
-            # 计算最好分值的走法
-            # alpha/beta 剪枝
-            if score > alpha:
-                alpha = score
-                bestmove = (row, col)
-                if alpha >= beta:
+    # 逐格对比：把每条直线放到棋盘上，用原来的逐个棋子分析结果校验
+    def verify (self, samples = 2000, seed = 0):
+        import random
+        ref = self.reference
+        rand = random.Random(seed)
+        keys = list(self.table.keys())
+        rand.shuffle(keys)
+        keys = keys[:samples]
+        for i in range(samples - len(keys)):
+            num = rand.choice((5, 9, 11, 13, 15))
+            code = 0
+            for k in range(num):
+                code |= rand.choice((0, 0, 1, 2)) << (k * 2)
+            keys.append((code << 6) | (num << 1) | (i & 1))
+        # 选一条长度相同、分析顺序相同的直线来放置，超过 15 格的直线放到
+        # 同样尺寸的棋盘上
+        boards = {}         # 棋盘尺寸 -> (evaluation, 查表标记 -> 直线)
+        failed = 0
+        for key in keys:
+            code, tag = key >> 6, key & 63
+            num, reverse = tag >> 1, tag & 1
+            N = max(15, num)
+            if N not in boards:
+                e = ref
+                if N != ref.size:
+                    e = evaluation(None, N, ref.rules)
+                places = {}
+                for direction, cells, rev, t, slot in e.LINES:
+                    if t not in places or direction in (0, 1):
+                        places[t] = (direction, cells)
+                boards[N] = (e, places)
+            e, places = boards[N]
+            direction, cells = places[tag]
+            board = [ [ 0 for n in range(N) ] for m in range(N) ]
+            for k in range(num):
+                y, x = cells[k]
+                board[y][x] = (code >> (k * 2)) & 3
+            e.test(board)
+            records = self.lookup(code, num, reverse)[0]
+            for k in range(num):
+                y, x = cells[k]
+                if e.record[y][x][direction] != records[k]:
+                    failed += 1
                     break
-        
-        # 如果是第一层则记录最好的走法
-        if depth == self.maxdepth and bestmove:
-            self.bestmove = bestmove
+        return failed
 
-        # 返回当前最好的分数，和该分数的对应走法
-        return alpha
 
-    # 具体搜索：传入当前是该谁走(turn=1/2)，以及搜索深度(depth)
-    def search (self, turn, depth = 3):
-        self.maxdepth = depth
-        self.bestmove = None
-        score = self.__search(turn, depth)
-        if abs(score) > 8000:
-            self.maxdepth = depth
-            score = self.__search(turn, 1)
-        row, col = self.bestmove
-        return score, row, col
+# 共享的直线棋型表：每种规则一个，第一次使用时从磁盘缓存加载，没有则生成
+# 并保存。缓存文件由环境变量 GOBANG_LINETABLE 指定，设置为空字符串则不使用
+# 缓存；freestyle 以外的规则在文件名后面加上规则名称
+def shared_linetable (rules = 'freestyle'):
+    table = _linetables.get(rules)
+    if table is None:
+        import os
+        table = linetable(rules = rules)
+        default = os.path.join(os.path.expanduser('~'), '.cache', 'gobang', 
+                'linetable-%d.bin'%table.VERSION)
+        filename = os.environ.get('GOBANG_LINETABLE', default)
+        if filename and rules != 'freestyle':
+            root, ext = os.path.splitext(filename)
+            filename = '%s-%s%s'%(root, rules, ext)
+        if not filename or not table.load(filename):
+            table.build()
+            if filename:
+                try:
+                    dirname = os.path.dirname(filename)
+                    if dirname and not os.path.exists(dirname):
+                        os.makedirs(dirname)
+                    table.save(filename)
+                except (IOError, OSError):
+                    pass
+        _linetables[rules] = table
+    return table
+
+_linetables = {}
 
 
 #----------------------------------------------------------------------
-# psyco speedup
+# incremental: 增量评估，落子/提子时只重新分析经过该点的四条直线
 #----------------------------------------------------------------------
-def psyco_speedup ():
-    try:
-        import psyco
-        psyco.bind(chessboard)
-        psyco.bind(evaluation)
-    except:
-        pass
-    return 0
+class incremental (object):
 
-psyco_speedup()
+    def __init__ (self, evaluator = None):
+        if evaluator is None:
+            evaluator = evaluation()
+        self.evaluator = evaluator
+        self.patterns = evaluator.patterns or shared_linetable()
+        self.lines = []         # 每条直线：(bitboard 直线编号, 查表标记)
+        self.index = []         # 每个格子四个方向所在直线的编号，-1 表示不足五格
+        size = evaluator.size
+        for i in range(size):
+            self.index.append([ [ -1, -1, -1, -1 ] for j in range(size) ])
+        for direction, cells, reverse, tag, slot in evaluator.LINES:
+            for i, j in cells:
+                self.index[i][j][direction] = len(self.lines)
+            self.lines.append((slot, tag))
+        self.board = bitboard(size = size)
+        self.contrib = [ () for n in range(len(self.lines)) ]
+        self.count = [ [ 0 for n in range(20) ] for m in range(3) ]
+        self.scratch = [ [ 0 for n in range(20) ] for m in range(3) ]
+        self.weight = [ 0, 0, 0 ]       # 双方位置权值
 
+    # 清空
+    def reset (self):
+        count = self.count
+        self.board.reset()
+        for i in range(20):
+            count[0][i] = count[1][i] = count[2][i] = 0
+        for i in range(len(self.contrib)):
+            self.contrib[i] = ()
+        self.weight[1] = self.weight[2] = 0
+        return 0
 
-#----------------------------------------------------------------------
-# main game
-#----------------------------------------------------------------------
-def gamemain():
-    b = chessboard()
-    s = searcher()
-    s.board = b.board()
+    # 从棋盘加载：每条直线只分析一次
+    def load (self, board):
+        self.reset()
+        POS = self.evaluator.POS
+        size = self.evaluator.size
+        for i in range(size):
+            for j in range(size):
+                stone = board[i][j]
+                if stone:
+                    self.board.put(i, j, stone)
+                    self.weight[stone] += POS[i][j]
+        for lid in range(len(self.lines)):
+            self.__update(lid)
+        return 0
 
-    opening = [
-        '1:HH 2:II',
-        #'2:IG 2:GI 1:HH',
-        '1:IH 2:GI',
-        '1:HG 2:HI',
-        #'2:HG 2:HI 1:HH',
-        #'1:HH 2:IH 2:GI',
-        #'1:HH 2:IH 2:HI',
-        #'1:HH 2:IH 2:HJ',
-        #'1:HG 2:HH 2:HI',
-        #'1:GH 2:HH 2:HI',
-    ]
+    # 落子
+    def apply (self, row, col, stone):
+        stats = self.evaluator.stats
+        if stats is not None:
+            t = stats.clock()
+        self.board.put(row, col, stone)
+        self.weight[stone] += self.evaluator.POS[row][col]
+        for lid in self.index[row][col]:
+            if lid >= 0:
+                self.__update(lid)
+        if stats is not None:
+            stats.analysistime += stats.clock() - t
+        return 0
 
-    import random
-    openid = random.randint(0, len(opening) - 1)
-    b.loads(opening[openid])
-    turn = 2
-    history = []
-    undo = False
+    # 提子
+    def undo (self, row, col):
+        stats = self.evaluator.stats
+        if stats is not None:
+            t = stats.clock()
+        stone = self.board.get(row, col)
+        if stone:
+            self.board.put(row, col, 0)
+            self.weight[stone] -= self.evaluator.POS[row][col]
+            for lid in self.index[row][col]:
+                if lid >= 0:
+                    self.__update(lid)
+        if stats is not None:
+            stats.analysistime += stats.clock() - t
+        return 0
 
-    # 设置难度
-    DEPTH = 1
+    # 打分：结果和 evaluation.evaluate 完全一致
+    def evaluate (self, turn):
+        evaluator = self.evaluator
+        stats = evaluator.stats
+        if stats is not None:
+            t = stats.clock()
+        count, scratch = self.count, self.scratch
+        for i in range(20):
+            scratch[1][i] = count[1][i]
+            scratch[2][i] = count[2][i]
+        weight = self.weight
+        score = evaluator.rate(scratch, turn, weight[2], weight[1])
+        score = evaluator.adjust(score, scratch, turn)
+        if stats is not None:
+            stats.evaluations += 1
+            stats.evaltime += stats.clock() - t
+        return score
 
-    if len(sys.argv) > 1:
-        if sys.argv[1].lower() == 'hard':
-            DEPTH = 2
+    # 重新分析一条直线（查表），并更新棋型计数
+    def __update (self, lid):
+        slot, tag = self.lines[lid]
+        code = self.board.codes[slot]
+        patterns = ()
+        if code:
+            data = self.patterns.table.get((code << 6) | tag)
+            if data is None:
+                if self.evaluator.stats is not None:
+                    self.evaluator.stats.misses += 1
+                data = self.patterns.lookup(code, tag >> 1, tag & 1)
+            patterns = data[1]
+        count = self.count
+        for stone, pattern in self.contrib[lid]:
+            count[stone][pattern] -= 1
+        for stone, pattern in patterns:
+            count[stone][pattern] += 1
+        self.contrib[lid] = patterns
+        return 0
 
-    while 1:
-        print('')
-        while 1:
-            print('<ROUND %d>'%(len(history) + 1))
-            b.show()
-            print('Your move (u:undo, q:quit):', end='')
-            text = input().strip('\r\n\t ')
-            if len(text) == 2:
-                tr = ord(text[0].upper()) - ord('A')
-                tc = ord(text[1].upper()) - ord('A')
-                if tr >= 0 and tc >= 0 and tr < 15 and tc < 15:
-                    if b[tr][tc] == 0:
-                        row, col = tr, tc
-                        break
-                    else:
-                        print('can not move there')
-                else:
-                    print('bad position')
-            elif text.upper() == 'U':
-                undo = True
-                break
-            elif text.upper() == 'Q':
-                print(b.dumps())
-                return 0
-        
-        if undo == True:
-            undo = False
-            if len(history) == 0:
-                print('no history to undo')
-            else:
-                print('rollback from history ...')
-                move = history.pop()
-                b.loads(move)
-        else:
-            history.append(b.dumps())
-            b[row][col] = 1
 
-            if b.check() == 1:
-                b.show()
-                print(b.dumps())
-                print('')
-                print('YOU WIN !!')
-                return 0
+#----------------------------------------------------------------------
+# compact: 紧凑的评估核心，状态都在预先分配的 array/bytearray 里，
+# 评估叶子节点时不创建新的容器对象；结果和 evaluation.evaluate 完全一致，
+# 但是不填写逐格的分析结果（需要时调用 analyse）
+#----------------------------------------------------------------------
+class compact (object):
 
-            print('robot is thinking now ...')
-            score, row, col = s.search(2, DEPTH)
-            cord = '%s%s'%(chr(ord('A') + row), chr(ord('A') + col))
-            print('robot move to %s (%d)'%(cord, score))
-            b[row][col] = 2
+    __slots__ = ('evaluator', 'patterns', 'lines', 'count', 'zero', 
+            'POS', 'record', 'size')
 
-            if b.check() == 2:
+    def __init__ (self, evaluator = None):
+        import array
+        if evaluator is None:
+            evaluator = evaluation()
+        self.evaluator = evaluator
+        self.patterns = evaluator.patterns or shared_linetable()
+        # 每条直线：(格子坐标, 方向, 查表标记, bitboard 直线编号)
+        self.lines = tuple([ (cells, direction, tag, slot) for direction, 
+            cells, reverse, tag, slot in evaluator.LINES ])
+        self.count = [ array.array('i', [ 0 ] * 20) for n in range(3) ]
+        self.zero = array.array('i', [ 0 ] * 20)
+        self.POS = evaluator.POS
+        self.size = evaluator.size
+        self.record = bytearray(self.size * self.size * 4)  # [行][列][方向]
+
+    # 打分
+    def evaluate (self, board, turn):
+        stats = self.evaluator.stats
+        if stats is not None:
+            t = stats.clock()
+        count, zero = self.count, self.zero
+        count[1][:] = zero
+        count[2][:] = zero
+        table = self.patterns.table
+        codes = getattr(board, 'codes', None)
+        for cells, direction, tag, slot in self.lines:
+            if codes is not None:
+                code = codes[slot]
+            else:
+                code, shift = 0, 0
+                for y, x in cells:
+                    code |= board[y][x] << shift
+                    shift += 2
+            if code:
+                data = table.get((code << 6) | tag)
+                if data is None:
+                    data = self.patterns.lookup(code, tag >> 1, tag & 1)
+                for stone, pattern in data[1]:
+                    count[stone][pattern] += 1
+        POS, N = self.POS, self.size
+        wc, bc = 0, 0
+        for i in range(N):
+            row, weight = board[i], POS[i]
+            for j in range(N):
+                stone = row[j]
+                if stone == 2:
+                    wc += weight[j]
+                elif stone:
+                    bc += weight[j]
+        evaluator = self.evaluator
+        score = evaluator.rate(count, turn, wc, bc)
+        score = evaluator.adjust(score, count, turn)
+        if stats is not None:
+            stats.evaluations += 1
+            stats.evaltime += stats.clock() - t
+        return score
+
+    # 填写逐格分析结果，record[(行 * 尺寸 + 列) * 4 + 方向] 和 
+    # evaluation.record[行][列][方向] 相同
+    def analyse (self, board):
+        record, N = self.record, self.size
+        ANALYSED = self.evaluator.ANALYSED
+        for i in range(len(record)):
+            record[i] = 0
+        for cells, direction, tag, slot in self.lines:
+            code, shift = 0, 0
+            for y, x in cells:
+                code |= board[y][x] << shift
+                shift += 2
+            if code:
+                records = self.patterns.lookup(code, tag >> 1, tag & 1)[0]
+                for k in range(len(cells)):
+                    y, x = cells[k]
+                    record[(y * N + x) * 4 + direction] = records[k]
+        for direction, cells in self.evaluator.SHORTS:
+            for y, x in cells:
+                if board[y][x]:
+                    for y, x in cells:
+                        record[(y * N + x) * 4 + direction] = ANALYSED
+                    break
+        return record
+
+
+#----------------------------------------------------------------------
+# batchevaluation: 用 NumPy 一次评估多个棋盘，结果和 evaluation.evaluate 
+# 完全一致；没有安装 NumPy 时逐个调用 evaluation.evaluate
+#----------------------------------------------------------------------
+class batchevaluation (object):
+
+    # limit: 直线棋型计数缓存的表项上限，超过时清空
+    def __init__ (self, evaluator = None, chunk = 1024, limit = 1 << 16):
+        if evaluator is None:
+            evaluator = evaluation()
+        self.evaluator = evaluator
+        self.patterns = evaluator.patterns or shared_linetable()
+        self.chunk = chunk          # 每次向量化处理的棋盘数，限制临时内存
+        self.limit = limit
+        self.size = N = evaluator.size
+        self.cells = cells = N * N
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self.numpy = numpy
+        if numpy is None:
+            return
+        np = numpy
+        # 每条直线的格子编号，不足 N 格的用第 N * N 格（总是空）补齐
+        lines = evaluator.LINES
+        index = np.full((len(lines), N), cells, dtype = np.intp)
+        shift = np.zeros((len(lines), N), dtype = np.int64)
+        tags = np.zeros(len(lines), dtype = np.int64)
+        for n, (direction, line, reverse, tag, slot) in enumerate(lines):
+            for k, (y, x) in enumerate(line):
+                index[n][k] = y * N + x
+                shift[n][k] = k * 2
+            tags[n] = tag
+        self.index, self.shift, self.tags = index, shift, tags
+        self.POS = np.array(evaluator.POS, dtype = np.int64).reshape(cells)
+        self.values = np.arange(8, dtype = np.int64)
+        self.cache = {}     # 直线查表键 -> 棋型计数向量
+
+    # 把多个棋盘堆成 (个数, 尺寸, 尺寸) 的数组
+    def stack (self, boards):
+        return self.numpy.asarray([ [ list(row) for row in b ] for b in boards ],
+                dtype = self.numpy.int64).reshape(-1, self.size, self.size)
+
+    # 一个节点的所有子节点：在 board 上依次落下 moves 里的每一步
+    def expand (self, board, moves, stone):
+        np = self.numpy
+        base = np.asarray([ list(row) for row in board ], dtype = np.int64)
+        boards = np.repeat(base[None, :, :], len(moves), axis = 0)
+        for n, move in enumerate(moves):
+            boards[n, move[-2], move[-1]] = stone
+        return boards
+
+    # 一条直线的棋型计数：长度 24 的向量，下标为 棋子 * 8 + 棋型
+    def __contrib (self, key):
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.numpy.zeros(24, dtype = self.numpy.int64)
+            code, tag = key >> 6, key & 63
+            if code:
+                data = self.patterns.table.get(key)
+                if data is None:
+                    data = self.patterns.lookup(code, tag >> 1, tag & 1)
+                for stone, pattern in data[1]:
+                    vector[stone * 8 + pattern] += 1
+            if len(self.cache) >= self.limit:
+                self.cache.clear()
+            self.cache[key] = vector
+        return vector
+
+    # 棋型计数：返回 (N, 3, 8) 的数组，count[n][棋子][棋型]
+    def counts (self, boards):
+        np = self.numpy
+        cells = self.cells
+        boards = np.asarray(boards, dtype = np.int64).reshape(-1, cells)
+        flat = np.zeros((len(boards), cells + 1), dtype = np.int64)
+        flat[:, :cells] = boards
+        codes = (flat[:, self.index] << self.shift).sum(axis = 2)
+        keys = (codes << 6) | self.tags
+        unique, inverse = np.unique(keys, return_inverse = True)
+        table = np.array([ self.__contrib(int(key)) for key in unique ],
+                dtype = np.int64).reshape(-1, 24)
+        count = table[inverse.reshape(keys.shape)].sum(axis = 1)
+        return count.reshape(-1, 3, 8)
+
+    # 评估：boards 是 (个数, 尺寸, 尺寸) 数组或者棋盘列表，turn 是整数或者长度 N 的序列
+    # 返回分数列表，有没有 NumPy 都一样
+    def evaluate (self, boards, turn):
+        np = self.numpy
+        if np is None:
+            evaluator = self.evaluator
+            if isinstance(turn, int):
+                turns = [ turn ] * len(boards)
+            else:
+                turns = turn
+            return [ evaluator.evaluate(b, t) for b, t in zip(boards, turns) ]
+        if not isinstance(boards, np.ndarray):
+            boards = self.stack(boards)
+        boards = boards.reshape(-1, self.cells)
+        turns = np.broadcast_to(np.asarray(turn, dtype = np.int64), 
+                (len(boards), ))
+        scores = []
+        for start in range(0, len(boards), self.chunk):
+            end = start + self.chunk
+            scores.append(self.__evaluate(boards[start:end], turns[start:end]))
+        if not scores:
+            return []
+        return np.concatenate(scores).tolist()
+
+    # 向量化的 evaluation.rate 和 evaluation.adjust：按 当前方/对方 对称地计算
+    def __evaluate (self, boards, turns):
+        np = self.numpy
+        e = self.evaluator
+        FIVE, FOUR, SFOUR = e.FIVE, e.FOUR, e.SFOUR
+        THREE, STHREE, TWO, STWO = e.THREE, e.STHREE, e.TWO, e.STWO
+        count = self.counts(boards)
+        rows = np.arange(len(boards))
+        me = count[rows, turns]
+        op = count[rows, 3 - turns]
+        weight = np.stack([ np.zeros(len(boards), dtype = np.int64),
+            ((boards == 1) * self.POS).sum(axis = 1),
+            ((boards == 2) * self.POS).sum(axis = 1) ], axis = 1)
+        mw, ow = weight[rows, turns], weight[rows, 3 - turns]
+        # 没有五连时两个冲四算作一个活四（adjust 也使用修改后的计数）
+        five = (me[:, FIVE] > 0) | (op[:, FIVE] > 0)
+        me[:, FOUR] += (~five) & (me[:, SFOUR] >= 2)
+        op[:, FOUR] += (~five) & (op[:, SFOUR] >= 2)
+        mv = np.where(me[:, THREE] > 1, 2000, 
+                np.where(me[:, THREE] > 0, 200, 0))
+        ov = np.where(op[:, THREE] > 1, 500, np.where(op[:, THREE] > 0, 100, 0))
+        mv = mv + me[:, STHREE] * 10 + me[:, TWO] * 4 + me[:, STWO] + mw
+        ov = ov + op[:, STHREE] * 10 + op[:, TWO] * 4 + op[:, STWO] + ow
+        conditions = [
+            op[:, FIVE] > 0,
+            me[:, FIVE] > 0,
+            me[:, FOUR] > 0,
+            me[:, SFOUR] > 0,
+            op[:, FOUR] > 0,
+            (op[:, SFOUR] > 0) & (op[:, THREE] > 0),
+            (me[:, THREE] > 0) & (op[:, SFOUR] == 0),
+            (op[:, THREE] > 1) & (me[:, SFOUR] == 0) & (me[:, THREE] == 0) & 
+                (me[:, STHREE] == 0),
+        ]
+        choices = [ -9999, 9999, 9990, 9980, -9970, -9960, 9950, -9940 ]
+        score = np.select(conditions, choices, mv - ov)
+        # evaluation.adjust：胜负已分时加减出现过的棋型编号
+        values = self.values
+        score = np.where(score > 9000, score + ((me > 0) * values).sum(axis = 1),
+                score)
+        score = np.where(score < -9000, score - ((op > 0) * values).sum(axis = 1),
+                score)
+        return score
+
+
+#----------------------------------------------------------------------
+# zobrist: 局面哈希，每个格子每种棋子对应一个 64 位随机数
+#----------------------------------------------------------------------
+class zobrist (object):
+
+    def __init__ (self, seed = 0x6b616e67, size = 15):
+        import random
+        rand = random.Random(seed)
+        self.seed = seed
+        self.size = size
+        self.table = [ tuple([ (0, ) * size for i in range(size) ]) ]
+        for stone in (1, 2):
+            rows = []
+            for i in range(size):
+                rows.append(tuple([ rand.getrandbits(64) 
+                    for j in range(size) ]))
+            self.table.append(tuple(rows))
+        self.table = tuple(self.table)      # table[stone][row][col]
+        self.turn = (0, rand.getrandbits(64), rand.getrandbits(64))
+
+    # 计算整个棋盘的哈希值
+    def hash (self, board):
+        table = self.table
+        key = 0
+        for i in range(self.size):
+            row = board[i]
+            for j in range(self.size):
+                if row[j]:
+                    key ^= table[row[j]][i][j]
+        return key
+
+
+# 每种尺寸共享一个默认种子的 zobrist
+def shared_zobrist (size = 15):
+    data = _zobrists.get(size)
+    if data is None:
+        data = _zobrists[size] = zobrist(size = size)
+    return data
+
+_zobrists = {}
+
+
+#----------------------------------------------------------------------
+# transposition: 置换表，记录搜索过的局面（深度，分数，边界类型，最佳走法）
+#----------------------------------------------------------------------
+class transposition (object):
+
+    EXACT = 0       # 精确值
+    LOWER = 1       # 下界（发生 beta 剪枝）
+    UPPER = 2       # 上界（没有走法超过 alpha）
+    ENTRY = 160     # 每个表项大约占用的内存字节数
+
+    def __init__ (self, memory = 32 << 20):
+        self.resize(memory)
+
+    # 按照内存上限重新分配：每个桶两个槽，深度优先槽和总是替换槽
+    def resize (self, memory):
+        size = 2
+        while size * 2 * self.ENTRY <= memory:
+            size *= 2
+        self.memory = memory
+        self.size = size
+        self.mask = (size // 2) - 1
+        self.slots = [ None ] * size
+        self.generation = 0
+        self.entries = 0
+        return 0
+
+    # 清空
+    def clear (self):
+        for i in range(self.size):
+            self.slots[i] = None
+        self.generation = 0
+        self.entries = 0
+        return 0
+
+    # 每次新的搜索开始时调用，用来淘汰上一次搜索留下的旧数据
+    def newsearch (self):
+        self.generation = (self.generation + 1) & 0xffff
+        return self.generation
+
+    # 查找：返回 (key, depth, score, flag, move, generation) 或 None
+    def probe (self, key):
+        index = (key & self.mask) << 1
+        slots = self.slots
+        entry = slots[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = slots[index + 1]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    # 写入：深度不低于原有数据或者原有数据已经过期时写入深度优先槽，否则写入总是替换槽
+    def store (self, key, depth, score, flag, move):
+        index = (key & self.mask) << 1
+        slots = self.slots
+        entry = slots[index]
+        data = (key, depth, score, flag, move, self.generation)
+        if entry is None:
+            self.entries += 1
+            slots[index] = data
+        elif depth >= entry[1] or entry[5] != self.generation:
+            if entry[0] != key:     # 原有数据降级到总是替换槽
+                if slots[index + 1] is None:
+                    self.entries += 1
+                slots[index + 1] = entry
+            slots[index] = data
+        else:
+            if slots[index + 1] is None:
+                self.entries += 1
+            slots[index + 1] = data
+        return 0
+
+
+#----------------------------------------------------------------------
+# evalcache: 评估缓存，局面哈希（含轮到谁走）-> 分数
+# 内存里是 LRU，可选的磁盘层是 mmap 映射的开放寻址哈希表，重启以后仍然
+# 有效，多个进程可以同时映射同一个文件
+#----------------------------------------------------------------------
+class evalcache (object):
+
+    MAGIC = b'GBEC'
+    VERSION = 2
+    # 标识，版本，zobrist 种子，评估指纹，棋盘尺寸，规则编号，槽位数
+    HEADER = '<4sIIIHHI'
+    ENTRY = '<QiI'          # 哈希，分数，校验（并发写入被打断时校验失败）
+    PROBE = 4               # 线性探测的槽位数
+
+    # boardsize/rules: 棋盘尺寸和规则，不同的尺寸和规则使用不同的文件
+    def __init__ (self, size = 1 << 16, filename = None, slots = 1 << 20, 
+            writable = True, boardsize = 15, rules = 'freestyle'):
+        import collections, struct
+        self.size = size
+        self.boardsize = boardsize
+        self.rules = rules
+        self.memory = collections.OrderedDict()
+        self.dirty = set()      # 还没有写到磁盘层的哈希
+        self.hsize = struct.calcsize(self.HEADER)
+        self.esize = struct.calcsize(self.ENTRY)
+        self.data = None
+        self.file = None
+        self.slots = 0
+        self.writable = False
+        self.hits = 0           # 内存命中
+        self.diskhits = 0       # 磁盘命中
+        self.misses = 0
+        self.evictions = 0
+        if filename:
+            self.open(filename, slots, writable)
+
+    # 评估指纹：棋型表指纹加上一组固定局面的分数（按照缓存的棋盘尺寸和
+    # 规则评估），评估函数改变以后磁盘层失效
+    def fingerprint (self):
+        import random, zlib
+        N = self.boardsize
+        e = evaluation(size = N, rules = self.rules)
+        rand = random.Random(23)
+        data = [ e.patterns.fingerprint(), N, self.rules ]
+        for i in range(16):
+            board = [ [ 0 for n in range(N) ] for m in range(N) ]
+            for k in range(rand.randint(4, 60)):
+                board[rand.randint(0, N - 1)][rand.randint(0, N - 1)] = \
+                        rand.randint(1, 2)
+            data.append(e.evaluate(board, 1))
+            data.append(e.evaluate(board, 2))
+        return zlib.crc32(repr(data).encode('utf-8')) & 0xffffffff
+
+    # 打开磁盘层，文件不存在或者不匹配时（可写模式下）重新创建
+    # 15 路 freestyle 以外的缓存在文件名后面加上尺寸和规则，共用一个文件名
+    # 的多种 searcher 不会互相覆盖
+    def open (self, filename, slots = 1 << 20, writable = True):
+        import mmap, struct, os
+        self.close()
+        if self.boardsize != 15 or self.rules != 'freestyle':
+            root, ext = os.path.splitext(filename)
+            filename = '%s-%d-%s%s'%(root, self.boardsize, self.rules, ext)
+        header = (self.MAGIC, self.VERSION, zobrist(size = self.boardsize).seed,
+                self.fingerprint(), self.boardsize, 
+                ruleset.NAMES.index(self.rules))
+        try:
+            fp = open(filename, writable and 'r+b' or 'rb')
+            fp.seek(0, 2)
+            size = fp.tell()
+            fp.seek(0)
+            current = size >= self.hsize and \
+                    struct.unpack(self.HEADER, fp.read(self.hsize)) or None
+            if current is None or current[:6] != header or \
+                    size < self.hsize + current[6] * self.esize:
+                fp.close()
+                fp = None
+            else:
+                slots = current[6]
+        except (IOError, OSError):
+            fp = None
+        if fp is None:
+            if not writable:
+                return False
+            # 先写到临时文件再改名，多个进程同时创建时不会互相截断
+            slots = 1 << max(4, (max(slots, 16) - 1).bit_length())
+            temp = '%s.%d'%(filename, os.getpid())
+            with open(temp, 'wb') as fp:
+                fp.write(struct.pack(self.HEADER, *(header + (slots, ))))
+                fp.truncate(self.hsize + slots * self.esize)
+            os.rename(temp, filename)
+            fp = open(filename, 'r+b')
+            slots = struct.unpack(self.HEADER, fp.read(self.hsize))[6]
+        access = writable and mmap.ACCESS_WRITE or mmap.ACCESS_READ
+        self.data = mmap.mmap(fp.fileno(), 0, access = access)
+        self.file = fp
+        self.slots = slots
+        self.writable = writable
+        return True
+
+    # 把内存里的数据写到磁盘层并关闭
+    def close (self):
+        if self.data is not None:
+            self.flush()
+            self.data.close()
+            self.file.close()
+        self.data, self.file, self.slots = None, None, 0
+        return 0
+
+    # 查询，没有则返回 None
+    def probe (self, key):
+        memory = self.memory
+        score = memory.pop(key, None)
+        if score is not None:
+            memory[key] = score
+            self.hits += 1
+            return score
+        if self.data is not None:
+            score = self.__read(key)
+            if score is not None:
+                self.diskhits += 1
+                self.__insert(key, score)
+                return score
+        self.misses += 1
+        return None
+
+    def store (self, key, score):
+        if key in self.memory:
+            self.memory.pop(key)
+        self.__insert(key, score)
+        if self.data is not None and self.writable:
+            self.dirty.add(key)
+        return 0
+
+    # 新的表项写到磁盘层
+    def flush (self):
+        if self.data is not None and self.writable:
+            memory = self.memory
+            for key in self.dirty:
+                if key in memory:
+                    self.__write(key, memory[key])
+            self.data.flush()
+        self.dirty.clear()
+        return 0
+
+    def clear (self):
+        self.memory.clear()
+        self.dirty.clear()
+        return 0
+
+    # 计数器
+    def counters (self):
+        return { 'hits': self.hits, 'disk_hits': self.diskhits, 
+                'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.memory), 'slots': self.slots }
+
+    # 插入内存，超出容量时淘汰最久没有使用的表项（可写时写到磁盘层）
+    def __insert (self, key, score):
+        memory = self.memory
+        memory[key] = score
+        if len(memory) > self.size:
+            old, value = memory.popitem(last = False)
+            self.evictions += 1
+            if old in self.dirty:
+                self.dirty.discard(old)
+                self.__write(old, value)
+        return 0
+
+    def __check (self, key, score):
+        return ((key >> 32) ^ key ^ (score & 0xffffffff) ^ 0x5bd1e995) \
+                & 0xffffffff
+
+    def __read (self, key):
+        import struct
+        mask = self.slots - 1
+        for k in range(self.PROBE):
+            offset = self.hsize + ((key + k) & mask) * self.esize
+            entry, score, check = struct.unpack_from(self.ENTRY, self.data, 
+                    offset)
+            if entry == 0:
+                return None
+            if entry == key:
+                if check != self.__check(key, score):
+                    return None
+                return score
+        return None
+
+    # 写入：相同的哈希覆盖，否则找空位，都没有则覆盖第一个槽位
+    def __write (self, key, score):
+        import struct
+        mask = self.slots - 1
+        target = None
+        for k in range(self.PROBE):
+            offset = self.hsize + ((key + k) & mask) * self.esize
+            entry = struct.unpack_from('<Q', self.data, offset)[0]
+            if entry == key or entry == 0:
+                target = offset
+                break
+        if target is None:
+            target = self.hsize + (key & mask) * self.esize
+        struct.pack_into(self.ENTRY, self.data, target, key & 0xffffffffffffffff,
+                score, self.__check(key, score))
+        return 0
+
+
+#----------------------------------------------------------------------
+# candidate: 候选点集合，只保留已有棋子周围 radius 格以内的位置
+#----------------------------------------------------------------------
+class candidate (object):
+
+    def __init__ (self, radius = 2, size = 15):
+        N = size
+        self.radius = radius
+        self.size = size
+        self.around = []        # 每个格子周围 radius 格以内的格子编号
+        for i in range(N):
+            for j in range(N):
+                cells = []
+                for y in range(max(0, i - radius), min(N, i + radius + 1)):
+                    for x in range(max(0, j - radius), min(N, j + radius + 1)):
+                        if y != i or x != j:
+                            cells.append(y * N + x)
+                self.around.append(tuple(cells))
+        # 按行列索引的 around
+        self.grid = [ self.around[i * N:i * N + N] for i in range(N) ]
+        self.near = [ 0 for n in range(N * N) ]     # 每个格子周围的棋子数
+        self.cells = set()      # 周围有棋子的格子（包括已经落子的）
+        self.stones = 0
+
+    # 清空
+    def reset (self):
+        near = self.near
+        for i in range(len(near)):
+            near[i] = 0
+        self.cells.clear()
+        self.stones = 0
+        return 0
+
+    # 从棋盘重新生成
+    def load (self, board):
+        self.reset()
+        for i in range(self.size):
+            for j in range(self.size):
+                if board[i][j]:
+                    self.place(i, j)
+        return 0
+
+    # 落子：更新周围格子的计数
+    def place (self, row, col):
+        near, cells = self.near, self.cells
+        for k in self.grid[row][col]:
+            if near[k] == 0:
+                cells.add(k)
+            near[k] += 1
+        self.stones += 1
+        return 0
+
+    # 提子：落子的逆操作
+    def remove (self, row, col):
+        near, cells = self.near, self.cells
+        for k in self.grid[row][col]:
+            near[k] -= 1
+            if near[k] == 0:
+                cells.discard(k)
+        self.stones -= 1
+        return 0
+
+
+#----------------------------------------------------------------------
+# threat: 威胁空间搜索，只考虑连续冲四（VCF）或者冲四活三（VCT）的必胜走法
+#----------------------------------------------------------------------
+class threat (object):
+
+    # boardsize: 棋盘尺寸
+    def __init__ (self, nodes = 3000, size = 1 << 16, boardsize = 15):
+        self.evaluator = evaluation(size = boardsize)
+        self.patterns = self.evaluator.patterns or shared_linetable()
+        self.board = bitboard(size = boardsize)
+        self.zobrist = zobrist(size = boardsize)
+        self.boardsize = boardsize
+        self.maxnodes = nodes       # 每次求解的节点上限
+        self.deadline = None        # 求解的截止时间，None 则不限
+        self.size = size            # 缓存表项上限
+        self.cache = {}             # 局面哈希 -> (必胜走法或者 None, 搜索深度)
+        self.shapes = {}            # 直线编码和落子位置 -> 棋型变化
+        self.moves = {}             # 直线编码 -> 能够形成威胁的位置
+        self.nodes = 0
+        self.hits = 0               # 缓存命中次数
+        self.aborted = False
+        self.hash = 0
+        self.fives = [ None, set(), set() ]     # 双方的成五点
+        self.VCT = zobrist(0x766374).turn[1]
+        # 每个格子四个方向：(方向, 直线编号, 位移, 查表标记)，不足五格的直线忽略
+        tags = {}
+        for direction, cells, reverse, tag, slot in self.evaluator.LINES:
+            tags[slot] = tag
+        self.lines = []
+        for slots in self.board.slots:
+            lines = []
+            for direction in range(4):
+                slot, shift = slots[direction]
+                if slot in tags:
+                    lines.append((direction, slot, shift, tags[slot]))
+            self.lines.append(tuple(lines))
+
+    # 求解：stone 方先走，返回必胜的第一步 (row, col)，没有找到返回 None
+    # deadline: 截止时间（time.time()），到达后和超过节点上限一样放弃
+    def solve (self, board, stone, vct = False, depth = None, nodes = None,
+            deadline = None):
+        if depth is None:
+            depth = vct and 5 or 12
+        bb = self.board
+        bb.reset()
+        N = self.boardsize
+        for i in range(N):
+            for j in range(N):
+                if board[i][j]:
+                    bb.put(i, j, board[i][j])
+        self.hash = self.zobrist.hash(board)
+        self.fives = [ None, set(), set() ]
+        for i in range(N):
+            for j in range(N):
+                if board[i][j]:
+                    self.fives[board[i][j]].update(self.__fives(i, j))
+        if len(self.cache) >= self.size:
+            self.cache.clear()
+        self.nodes = 0
+        self.hits = 0
+        self.aborted = False
+        self.deadline = deadline
+        limit = self.maxnodes
+        if nodes is not None:
+            self.maxnodes = nodes
+        try:
+            return self.__attack(stone, depth, vct)
+        finally:
+            self.maxnodes = limit
+            self.deadline = None
+
+    # 经过 (row, col) 的直线上，stone 方再下一子就能成五的空位
+    def __fives (self, row, col, stone = None):
+        board = self.board.board()
+        N = self.boardsize
+        if stone is None:
+            stone = board[row][col]
+        points = []
+        for dy, dx in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            for start in range(-4, 1):
+                gap = None
+                for k in range(start, start + 5):
+                    y, x = row + dy * k, col + dx * k
+                    if y < 0 or y >= N or x < 0 or x >= N:
+                        break
+                    ch = board[y][x]
+                    if ch == stone:
+                        continue
+                    if ch != 0 or gap is not None:
+                        break
+                    gap = (y, x)
+                else:
+                    if gap is not None:
+                        points.append(gap)
+        return points
+
+    # 在 (row, col) 落子以后，四个方向上新增的棋型：(成五, 冲四或活四, 活三方向)
+    def __shape (self, row, col, stone):
+        codes, shapes = self.board.codes, self.shapes
+        five, four, three = False, False, []
+        for direction, slot, shift, tag in self.lines[row * self.boardsize + col]:
+            key = (((codes[slot] << 6) | tag) << 6) | shift | (stone - 1)
+            kind = shapes.get(key)
+            if kind is None:
+                kind = self.__kind(codes[slot], tag, shift, stone)
+                if len(shapes) >= self.size:
+                    shapes.clear()
+                shapes[key] = kind
+            if kind == 3:
+                five = True
+            elif kind == 2:
+                four = True
+            elif kind == 1:
+                three.append(direction)
+        return five, four, three
+
+    # 一条直线上落子前后的棋型变化：3 成五，2 冲四或活四，1 活三，0 没有
+    def __kind (self, code, tag, shift, stone):
+        counts = [ 0, 0, 0, 0, 0, 0, 0, 0 ]
+        for code, sign in ((code, -1), (code | (stone << shift), 1)):
+            data = self.patterns.lookup(code, tag >> 1, tag & 1)
+            for s, pattern in data[1]:
+                if s == stone:
+                    counts[pattern] += sign
+        if counts[7] > 0:
+            return 3
+        if counts[6] > 0 or counts[3] > 0:
+            return 2
+        if counts[5] > 0:
+            return 1
+        return 0
+
+    # 落子，返回恢复用的数据
+    def __move (self, row, col, stone):
+        saved = (self.fives[1], self.fives[2])
+        self.board.put(row, col, stone)
+        self.hash ^= self.zobrist.table[stone][row][col]
+        fives = [ None, set(saved[0]), set(saved[1]) ]
+        fives[1].discard((row, col))
+        fives[2].discard((row, col))
+        fives[stone].update(self.__fives(row, col, stone))
+        self.fives = fives
+        return saved
+
+    # 提子
+    def __unmove (self, row, col, stone, saved):
+        self.board.put(row, col, 0)
+        self.hash ^= self.zobrist.table[stone][row][col]
+        self.fives = [ None, saved[0], saved[1] ]
+        return 0
+
+    # 产生进攻走法：冲四在前，活三在后（VCT 时）
+    def __threats (self, stone, vct):
+        codes, moves = self.board.codes, self.moves
+        MASK = self.board.MASK << (stone - 1)
+        fours, threes = set(), {}
+        for direction, cells, reverse, tag, slot in self.evaluator.LINES:
+            code = codes[slot]
+            if not (code & MASK):
+                continue
+            key = (((code << 6) | tag) << 1) | (stone - 1)
+            points = moves.get(key)
+            if points is None:
+                points = []
+                for k in range(tag >> 1):
+                    if (code >> (k * 2)) & 3 == 0:
+                        kind = self.__kind(code, tag, k * 2, stone)
+                        if kind:
+                            points.append((k, kind))
+                if len(moves) >= self.size:
+                    moves.clear()
+                points = moves[key] = tuple(points)
+            for k, kind in points:
+                if kind >= 2:
+                    fours.add(cells[k])
+                elif vct:
+                    threes.setdefault(cells[k], []).append(direction)
+        result = [ (row, col, None) for row, col in sorted(fours) ]
+        for row, col in sorted(threes):
+            if (row, col) not in fours:
+                result.append((row, col, threes[(row, col)]))
+        return result
+
+    # 进攻方节点：返回必胜走法或者 None
+    def __attack (self, stone, depth, vct):
+        other = stone == 1 and 2 or 1
+        fives = self.fives
+        if fives[stone]:
+            return min(fives[stone])
+        if depth <= 0:
+            return None
+        if self.nodes >= self.maxnodes:
+            self.aborted = True
+            return None
+        if self.deadline is not None and self.nodes & 63 == 0 and \
+                time.time() >= self.deadline:
+            self.aborted = True
+            return None
+        self.nodes += 1
+        key = self.hash ^ self.zobrist.turn[stone] ^ (vct and self.VCT or 0)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if cached[0] is not None or cached[1] >= depth:
+                self.hits += 1
+                return cached[0]
+        if fives[other]:
+            # 对方已经冲四：只能去堵，并且堵的这一步本身也要形成威胁
+            moves = []
+            if len(fives[other]) == 1:
+                row, col = min(fives[other])
+                five, four, three = self.__shape(row, col, stone)
+                if four:
+                    moves.append((row, col, None))
+                elif vct and three:
+                    moves.append((row, col, three))
+        else:
+            moves = self.__threats(stone, vct)
+        result = None
+        for row, col, three in moves:
+            saved = self.__move(row, col, stone)
+            won = self.__defend(stone, depth, vct, row, col, three)
+            self.__unmove(row, col, stone, saved)
+            if won:
+                result = (row, col)
+                break
+            if self.aborted:
+                return None
+        self.cache[key] = (result, depth)
+        return result
+
+    # 防守方节点：所有防守走法都失败则返回 True
+    def __defend (self, stone, depth, vct, row, col, three):
+        other = stone == 1 and 2 or 1
+        points = self.fives[stone]
+        if points:
+            if len(points) >= 2:        # 活四或者双冲四，无法防守
+                return True
+            replies = list(points)
+        elif three:
+            # 活三：可以堵在对方能够冲四的位置上，或者自己冲四反击
+            replies = set()
+            board = self.board.board()
+            N = self.boardsize
+            for direction in three:
+                dy, dx = ((0, 1), (1, 0), (1, 1), (1, -1))[direction]
+                for k in range(-4, 5):
+                    y, x = row + dy * k, col + dx * k
+                    if y < 0 or y >= N or x < 0 or x >= N:
+                        continue
+                    if board[y][x] == 0:
+                        five, four, t = self.__shape(y, x, stone)
+                        if five or four:
+                            replies.add((y, x))
+            for y, x, t in self.__threats(other, False):
+                replies.add((y, x))
+            replies = sorted(replies)
+        else:
+            return False
+        for y, x in replies:
+            saved = self.__move(y, x, other)
+            move = self.__attack(stone, depth - 1, vct)
+            self.__unmove(y, x, other, saved)
+            if move is None:
+                return False
+        return True
+
+
+#----------------------------------------------------------------------
+# statistics: 搜索统计，searcher.stats 设置以后才记录，否则几乎没有开销
+#----------------------------------------------------------------------
+class statistics (object):
+
+    def __init__ (self):
+        self.clock = getattr(time, 'perf_counter', time.time)
+        self.reset()
+
+    # 清空
+    def reset (self):
+        self.nodes = [ 0 ] * 32         # 每层节点数（按距离根节点的层数）
+        self.leaves = [ 0 ] * 32        # 每层叶子节点数（评估后直接返回）
+        self.expanded = 0               # 展开了走法的内部节点数
+        self.cutoffs = 0                # beta 剪枝次数
+        self.firstcuts = 0              # 第一个走法就剪枝的次数
+        self.evaluations = 0            # evaluate 调用次数（含增量评估）
+        self.evaltime = 0.0
+        self.analysistime = 0.0         # 直线分析（逐子分析或查表）时间
+        self.misses = 0                 # 棋型表没有命中，调用 analysis_line 的次数
+        self.probes = 0                 # 置换表查询次数
+        self.hits = 0                   # 置换表命中次数
+        self.ttcuts = 0                 # 置换表命中并直接返回的次数
+        self.threatnodes = 0            # 威胁空间搜索节点数
+        self.threathits = 0             # 威胁空间搜索缓存命中次数
+        self.threattime = 0.0
+        self.forbidchecks = 0           # 禁手检测次数
+        self.forbidhits = 0             # 禁手检测的局面缓存命中次数
+        self.forbidtime = 0.0
+        self.iterations = []            # 每轮完整搜索：(深度, 累计节点数, 累计秒数)
+        self.started = self.clock()
+        self.reported = self.started
+        return 0
+
+    # 记录节点，层数超出时扩展
+    def enter (self, ply):
+        if ply >= len(self.nodes):
+            self.nodes.extend([ 0 ] * (ply + 1 - len(self.nodes)))
+            self.leaves.extend([ 0 ] * (ply + 1 - len(self.leaves)))
+        self.nodes[ply] += 1
+        return 0
+
+    def elapsed (self):
+        return self.clock() - self.started
+
+    def cutrate (self):
+        return self.expanded and float(self.cutoffs) / self.expanded or 0.0
+
+    def firstrate (self):
+        return self.cutoffs and float(self.firstcuts) / self.cutoffs or 0.0
+
+    def hitrate (self):
+        return self.probes and float(self.hits) / self.probes or 0.0
+
+    # 结构化结果
+    def summary (self):
+        depth = len(self.nodes)
+        while depth > 0 and self.nodes[depth - 1] == 0:
+            depth -= 1
+        return {
+            'nodes': sum(self.nodes),
+            'nodes_per_ply': self.nodes[:depth],
+            'leaves_per_ply': self.leaves[:depth],
+            'cutoff_rate': self.cutrate(),
+            'first_cutoff_rate': self.firstrate(),
+            'evaluations': self.evaluations,
+            'evaluate_time': self.evaltime,
+            'analysis_time': self.analysistime,
+            'pattern_misses': self.misses,
+            'tt_probes': self.probes,
+            'tt_hit_rate': self.hitrate(),
+            'tt_cutoffs': self.ttcuts,
+            'threat_nodes': self.threatnodes,
+            'threat_cache_hits': self.threathits,
+            'threat_time': self.threattime,
+            'forbidden_checks': self.forbidchecks,
+            'forbidden_hits': self.forbidhits,
+            'forbidden_time': self.forbidtime,
+            'iterations': [ list(n) for n in self.iterations ],
+            'elapsed': self.elapsed(),
+        }
+
+    def __str__ (self):
+        data = self.summary()
+        text = []
+        text.append('nodes %d in %.3fs, per ply %s'%(data['nodes'], 
+            data['elapsed'], data['nodes_per_ply']))
+        text.append('leaves per ply %s'%data['leaves_per_ply'])
+        text.append('cutoff %.1f%%, first move %.1f%%'%(
+            data['cutoff_rate'] * 100, data['first_cutoff_rate'] * 100))
+        text.append('evaluate %d calls %.3fs, analysis %.3fs, misses %d'%(
+            data['evaluations'], data['evaluate_time'], 
+            data['analysis_time'], data['pattern_misses']))
+        text.append('table %d probes, hit %.1f%%, cutoffs %d'%(
+            data['tt_probes'], data['tt_hit_rate'] * 100, data['tt_cutoffs']))
+        text.append('threat %d nodes %d hits %.3fs'%(data['threat_nodes'],
+            data['threat_cache_hits'], data['threat_time']))
+        if data['forbidden_checks']:
+            text.append('forbidden %d checks %d hits %.3fs'%(
+                data['forbidden_checks'], data['forbidden_hits'], 
+                data['forbidden_time']))
+        for depth, nodes, seconds in self.iterations:
+            text.append('depth %d: %d nodes %.3fs'%(depth, nodes, seconds))
+        return '\n'.join(text)
+
+
+#----------------------------------------------------------------------
+# DFS: 博弈树搜索
+#----------------------------------------------------------------------
+class searcher (object):
+
+    # 候选点排序权值：SHAPE[相邻棋子数][两端空位数]
+    SHAPE = ( (0, 0, 0), (1, 5, 20), (2, 50, 400), (10, 500, 5000), 
+            (100000, 100000, 100000) )
+
+    # 排序分数低于该值的走法不形成威胁，杀手走法可以排在它们前面
+    QUIET = 2000
+
+    # 初始化：size 棋盘尺寸，rules 规则名称或者 ruleset
+    def __init__ (self, size = 15, rules = None):
+        if not isinstance(rules, ruleset):
+            rules = shared_ruleset(rules or 'freestyle')
+        N = size
+        self.size = size
+        self.rules = rules
+        self.evaluator = evaluation(size = size, rules = rules)
+        self.board = [ [ 0 for n in range(N) ] for i in range(N) ]
+        self.gameover = 0
+        self.overvalue = 0
+        self.maxdepth = 3
+        # 搜索时接管 board 的 chessboard，通过 make_move/unmake_move 同步
+        # 哈希，增量评估和候选点
+        self.position = chessboard(size = size, rules = rules)
+        self.zobrist = self.position.zobrist
+        self.table = transposition()    # 置换表，设置为 None 则关闭
+        self.radius = 2                 # 候选点半径，设置为 0 则枚举所有空位
+        self.incremental = incremental(self.evaluator)  # 增量评估，None 则关闭
+        self.compact = compact(self.evaluator)  # 关闭增量评估时使用
+        self.cache = None               # 叶子节点的评估缓存 evalcache
+        self.candidate = None
+        self.searching = False
+        self.nodes = 0                  # 最近一次搜索的节点数
+        self.depth = 0                  # 最近一次完整搜索的深度
+        self.pv = []                    # 最近一次搜索的主要变例
+        self.stopped = False
+        self.limited = False
+        self.deadline = None
+        self.nodelimit = None
+        self.renju = rules.renju and shared_renju(size) or None  # 禁手检测
+        self.threat = threat(boardsize = size)  # 威胁空间搜索，None 则关闭
+        if rules.name != 'freestyle':
+            self.threat = None          # 威胁空间搜索按照五子以上获胜求解
+        self.vcf = 3000                 # VCF 节点上限，0 则不搜索
+        self.vct = 1000                 # VCT 节点上限，0 则不搜索
+        self.hashmove = True            # 置换表记录的最佳走法排在前面
+        self.killer = True              # 杀手走法：同一层最近引起剪枝的走法
+        self.history = False            # 历史表：引起剪枝的走法按深度累计分数
+        self.pvs = False                # 主要变例搜索：除第一个走法外先用零窗口
+        self.killers = [ [ None, None ] for n in range(32) ]
+        self.histories = [ [ 0 ] * (N * N) for n in range(3) ]
+        self.stats = None               # 搜索统计 statistics，None 则不记录
+        self.progress = None            # 进度回调 progress(stats)，需要 stats
+        self.interval = 1.0             # 进度回调的间隔（秒）
+        self.rays = []                  # 每个格子四个方向两侧各四格的坐标
+        for i in range(N):
+            self.rays.append([])
+            for j in range(N):
+                rays = []
+                for dy, dx in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    pair = []
+                    for sign in (-1, 1):
+                        ray = []
+                        for k in range(1, 5):
+                            y, x = i + dy * k * sign, j + dx * k * sign
+                            if y < 0 or y >= N or x < 0 or x >= N:
+                                break
+                            ray.append((y, x))
+                        pair.append(tuple(ray))
+                    rays.append(tuple(pair))
+                self.rays[i].append(tuple(rays))
+
+    # 产生当前棋局的走法
+    def genmove (self, turn):
+        moves = []
+        board = self.board
+        POSES = self.evaluator.POS
+        N = self.size
+        if not self.radius:
+            for i in range(N):
+                for j in range(N):
+                    if board[i][j] == 0:
+                        score = POSES[i][j]
+                        moves.append((score, i, j))
+            moves.sort()
+            moves.reverse()
+            if self.renju is not None and turn == 1:
+                moves = self.__legal(moves)
+            return moves
+        cand = self.candidate
+        if cand is None or cand.radius != self.radius:
+            cand = self.candidate = candidate(self.radius, N)
+            cand.load(board)
+        elif not self.searching:    # 搜索以外调用时棋盘可能已经改变
+            cand.load(board)
+        if cand.stones == 0:
+            c = N // 2
+            return [ (POSES[c][c], c, c) ]
+        rays = self.rays
+        SHAPE = self.SHAPE
+        other = turn == 1 and 2 or 1
+        for k in cand.cells:
+            i, j = k // N, k % N
+            if board[i][j] != 0:
+                continue
+            score = POSES[i][j]
+            # 按照四个方向上相邻的己方和对方棋子数估算威胁程度
+            for pair in rays[i][j]:
+                for stone, weight in ((turn, 5), (other, 4)):
+                    n, o = 0, 0
+                    for ray in pair:
+                        for y, x in ray:
+                            ch = board[y][x]
+                            if ch == stone:
+                                n += 1
+                                continue
+                            if ch == 0:
+                                o += 1
+                            break
+                    if n:
+                        score += SHAPE[n > 4 and 4 or n][o] * weight
+            moves.append((score, i, j))
+        moves.sort()
+        moves.reverse()
+        if self.renju is not None and turn == 1:
+            moves = self.__legal(moves)
+        return moves
+
+    # 连珠规则：去掉黑棋的禁手。搜索中使用增量评估的 bitboard 和当前哈希
+    def __legal (self, moves):
+        detector, stats = self.renju, self.stats
+        if stats is not None:
+            t = stats.clock()
+            checks, hits = detector.checks, detector.hits
+        if self.searching:
+            board, key = self.board, self.position.hash
+            if self.incremental is not None:
+                board = self.incremental.board
+        else:
+            board, key = self.board, self.zobrist.hash(self.board)
+        moves = detector.filter(board, moves, key)
+        if stats is not None:
+            stats.forbidtime += stats.clock() - t
+            stats.forbidchecks += detector.checks - checks
+            stats.forbidhits += detector.hits - hits
+        return moves
+    
+    # 递归搜索：返回最佳分数
+    # last: 上一步的坐标，用来快速判断是否已经连成五子
+    def __search (self, turn, depth, alpha = -0x7fffffff, beta = 0x7fffffff, 
+            ply = 0, follow = False, last = None):
+
+        # 检查时间和节点数限制，超出则停止搜索
+        self.nodes += 1
+        if self.limited and (self.nodes & 63) == 0:
+            if self.nodelimit and self.nodes >= self.nodelimit:
+                self.stopped = True
+            elif self.deadline is not None and time.time() >= self.deadline:
+                self.stopped = True
+        if self.stopped:
+            return 0
+        stats = self.stats
+        if stats is not None:
+            stats.enter(ply)
+            if self.progress is not None and (self.nodes & 1023) == 0:
+                self.__report(False)
+
+        # 查询置换表（根节点需要记录最佳走法，所以不查询）
+        table = self.table
+        position = self.position
+        key = position.hash ^ self.zobrist.turn[turn]
+        entry = None
+        if table is not None and ply > 0:
+            entry = table.probe(key)
+            if stats is not None:
+                stats.probes += 1
+                stats.hits += entry is not None and 1 or 0
+            if entry is not None and entry[1] >= depth:
+                score, flag = entry[2], entry[3]
+                if flag == table.EXACT or \
+                        (flag == table.LOWER and score >= beta) or \
+                        (flag == table.UPPER and score <= alpha):
+                    if stats is not None:
+                        stats.ttcuts += 1
+                    return score
+
+        # 深度为零则评估棋盘并返回
+        inc = self.incremental
+        if depth <= 0:
+            cache = self.cache
+            score = None
+            if cache is not None:
+                score = cache.probe(key)
+            if score is None:
+                if inc is not None:
+                    score = inc.evaluate(turn)
+                else:
+                    score = self.compact.evaluate(self.board, turn)
+                if cache is not None:
+                    cache.store(key, score)
+            if table is not None:
+                table.store(key, 0, score, table.EXACT, -1)
+            if stats is not None:
+                stats.leaves[ply] += 1
+            return score
+
+        # 如果游戏结束则立马返回：知道上一步时只检查经过它的直线，连成五子
+        # 才需要评估出具体分数
+        if last is not None:
+            score = 0
+            if position.winner():
+                if inc is not None:
+                    score = inc.evaluate(turn)
+                else:
+                    score = self.compact.evaluate(self.board, turn)
+        elif inc is not None:
+            score = inc.evaluate(turn)
+        else:
+            score = self.compact.evaluate(self.board, turn)
+        if abs(score) >= 9999 and depth < self.maxdepth: 
+            if table is not None:
+                table.store(key, depth, score, table.EXACT, -1)
+            if stats is not None:
+                stats.leaves[ply] += 1
+            return score
+
+        # 产生新的走法，杀手走法排在威胁走法之后，其余走法之前；然后依次把
+        # 置换表走法，上一轮迭代的主要变例走法移到最前面
+        moves = self.genmove(turn)
+        history = self.histories[turn]
+        N = self.size
+        if self.history:
+            moves.sort(key = lambda m: (m[0], history[m[1] * N + m[2]]), 
+                    reverse = True)
+        if self.killer and ply < len(self.killers):
+            self.__killers(moves, self.killers[ply])
+        front = []
+        if self.hashmove and entry is not None and entry[4] >= 0:
+            front.append((entry[4] // N, entry[4] % N))
+        pvmove = None
+        if follow and ply < len(self.pv):
+            pvmove = self.pv[ply]
+            front.append(pvmove)
+        for move in front:
+            for i in range(len(moves)):
+                if moves[i][1] == move[0] and moves[i][2] == move[1]:
+                    moves.insert(0, moves.pop(i))
+                    break
+        bestmove = None
+        original = alpha
+        if stats is not None:
+            stats.expanded += 1
+
+        # 枚举当前所有走法
+        for score, row, col in moves:
+
+            # 标记当前走法到棋盘
+            position.make_move(row, col, turn)
+            
+            # 计算下一回合该谁走
+            nturn = turn == 1 and 2 or 1
+
+            # 深度优先搜索，返回评分，走的行和走的列
+            # 主要变例搜索：后面的走法先用零窗口证明不比 alpha 好，失败再重新搜索
+            follow = pvmove is not None and pvmove[0] == row and pvmove[1] == col
+            last = (row, col)
+            if self.pvs and bestmove is not None:
+                score = - self.__search(nturn, depth - 1, -alpha - 1, -alpha, 
+                        ply + 1, follow, last)
+                if score > alpha and score < beta and not self.stopped:
+                    score = - self.__search(nturn, depth - 1, -beta, -alpha, 
+                            ply + 1, follow, last)
+            else:
+                score = - self.__search(nturn, depth - 1, -beta, -alpha, 
+                        ply + 1, follow, last)
+
+            # 棋盘上清除当前走法
+            position.unmake_move()
+
+            # 超时则放弃本层结果
+            if self.stopped:
+                return alpha
+
+            # 计算最好分值的走法
+            # alpha/beta 剪枝
+            if score > alpha:
+                alpha = score
+                bestmove = (row, col)
+                if alpha >= beta:
+                    if stats is not None:
+                        stats.cutoffs += 1
+                        if moves[0][1] == row and moves[0][2] == col:
+                            stats.firstcuts += 1
+                    if ply < len(self.killers):
+                        killers = self.killers[ply]
+                        if killers[0] != bestmove:
+                            killers[1] = killers[0]
+                            killers[0] = bestmove
+                    history[row * N + col] += depth * depth
+                    break
+        
+        # 记录到置换表
+        if table is not None:
+            if alpha <= original:
+                flag = table.UPPER
+            elif alpha >= beta:
+                flag = table.LOWER
+            else:
+                flag = table.EXACT
+            move = -1
+            if bestmove is not None:
+                move = bestmove[0] * N + bestmove[1]
+            table.store(key, depth, alpha, flag, move)
+
+        # 如果是第一层则记录最好的走法
+        if depth == self.maxdepth and bestmove:
+            self.bestmove = bestmove
+
+        # 返回当前最好的分数，和该分数的对应走法
+        return alpha
+
+    # 把杀手走法移到第一个非威胁走法（排序分数低于 QUIET）的位置
+    def __killers (self, moves, killers):
+        QUIET = self.QUIET
+        for killer in killers:
+            if killer is None:
+                continue
+            index = None
+            for i in range(len(moves)):
+                if moves[i][1] == killer[0] and moves[i][2] == killer[1]:
+                    index = i
+                    break
+            if index is None or moves[index][0] >= QUIET:
+                continue
+            move = moves.pop(index)
+            for i in range(len(moves) + 1):
+                if i == len(moves) or moves[i][0] < QUIET:
+                    break
+            moves.insert(i, move)
+        return 0
+
+    # 搜索前根据当前棋盘重新计算哈希值，候选点和增量评估数据
+    def __prepare (self):
+        if self.table is not None:
+            self.table.newsearch()
+        if self.radius:
+            if self.candidate is None or self.candidate.radius != self.radius:
+                self.candidate = candidate(self.radius, self.size)
+        else:
+            self.candidate = None
+        self.position.bind(self.board, self.incremental, self.candidate)
+        self.nodes = 0
+        self.stopped = False
+        self.limited = False
+        self.deadline = None
+        self.nodelimit = None
+        self.pv = []
+        for killers in self.killers:
+            killers[0] = killers[1] = None
+        for history in self.histories:
+            for i in range(len(history)):
+                history[i] = 0
+        if self.progress is not None and self.stats is None:
+            self.stats = statistics()
+        if self.stats is not None:
+            self.stats.reset()
+        self.evaluator.stats = self.stats
+        if self.incremental is not None:
+            self.incremental.evaluator.stats = self.stats
+        return 0
+
+    # 调用进度回调，force 为假时按照 interval 间隔调用
+    def __report (self, force = True):
+        stats = self.stats
+        now = stats.clock()
+        if force or now - stats.reported >= self.interval:
+            stats.reported = now
+            self.progress(stats)
+        return 0
+
+    # 一轮完整搜索结束：记录每层用时，并报告进度
+    def __iteration (self, depth):
+        stats = self.stats
+        if stats is not None:
+            stats.iterations.append((depth, self.nodes, stats.elapsed()))
+            if self.progress is not None:
+                self.__report()
+        return 0
+
+    # 只搜索根节点的一个走法 (row, col)，alpha 为其它走法已经得到的最好分数
+    def searchmove (self, turn, depth, row, col, alpha = -0x7fffffff):
+        self.maxdepth = depth
+        self.__prepare()
+        self.position.make_move(row, col, turn)
+        try:
+            self.searching = True
+            nturn = turn == 1 and 2 or 1
+            score = - self.__search(nturn, depth - 1, -0x7fffffff, -alpha, 1,
+                    last = (row, col))
+        finally:
+            self.position.unmake_move()
+            self.searching = False
+        return score
+
+    # 威胁空间搜索：先找连续冲四，再找冲四活三的必胜走法
+    # deadline 为截止时间，到达后放弃求解
+    def threats (self, turn, deadline = None):
+        if self.threat is None:
+            return None
+        stats = self.stats
+        if stats is not None:
+            t = stats.clock()
+        move, nodes, hits = None, 0, 0
+        if self.vcf:
+            move = self.threat.solve(self.board, turn, False, nodes = self.vcf,
+                    deadline = deadline)
+            nodes, hits = self.threat.nodes, self.threat.hits
+        if move is None and self.vct:
+            move = self.threat.solve(self.board, turn, True, nodes = self.vct,
+                    deadline = deadline)
+            nodes, hits = nodes + self.threat.nodes, hits + self.threat.hits
+        if stats is not None:
+            stats.threatnodes += nodes
+            stats.threathits += hits
+            stats.threattime += stats.clock() - t
+        return move
+
+    # 沿置换表记录的最佳走法取出主要变例
+    def __principal (self, turn, depth):
+        table, board = self.table, self.board
+        pv, key = [], self.position.hash
+        if table is None:
+            return self.bestmove and [ self.bestmove ] or []
+        for k in range(depth):
+            entry = table.probe(key ^ self.zobrist.turn[turn])
+            if entry is None or entry[4] < 0:
+                break
+            row, col = entry[4] // self.size, entry[4] % self.size
+            if board[row][col] != 0:
+                break
+            pv.append((row, col))
+            board[row][col] = turn
+            key ^= self.zobrist.table[turn][row][col]
+            turn = turn == 1 and 2 or 1
+        for row, col in pv:
+            board[row][col] = 0
+        if self.bestmove and (not pv or pv[0] != self.bestmove):
+            pv = [ self.bestmove ]
+        return pv
+
+    # 具体搜索：传入当前是该谁走(turn=1/2)，以及搜索深度(depth)
+    # 指定 timeout（秒）或 nodes（节点数）时迭代加深：依次搜索 1, 2, 3 ... depth 层，
+    # 到达限制后返回最后一轮完整搜索的结果
+    def search (self, turn, depth = 3, timeout = None, nodes = None):
+        self.maxdepth = depth
+        self.bestmove = None
+        self.__prepare()
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self.nodelimit = nodes
+        move = self.threats(turn, self.deadline)
+        if move is not None:
+            self.bestmove = move
+            self.pv = [ move ]
+            self.depth = 0
+            return 9990, move[0], move[1]
+        self.searching = True
+        try:
+            if timeout is None and nodes is None:
+                score = self.__search(turn, depth)
+                if abs(score) > 8000:
+                    self.maxdepth = depth
+                    score = self.__search(turn, 1)
+                self.depth = depth
+                self.pv = self.__principal(turn, depth)
+                self.__iteration(depth)
+            else:
+                result = None
+                for d in range(1, depth + 1):
+                    self.maxdepth = d
+                    self.bestmove = None
+                    self.limited = (d > 1)      # 第一层总是完整搜索
+                    score = self.__search(turn, d, follow = True)
+                    if self.stopped:
+                        break
+                    result = (score, self.bestmove)
+                    self.depth = d
+                    self.pv = self.__principal(turn, d)
+                    self.__iteration(d)
+                    if abs(score) > 8000:       # 胜负已分，不用继续加深
+                        break
+                score, self.bestmove = result
+        finally:
+            self.searching = False
+        row, col = self.bestmove
+        return score, row, col
+
+
+#----------------------------------------------------------------------
+# parallel: 多进程并行搜索，根节点的走法分配给进程池，共享 alpha 值
+#----------------------------------------------------------------------
+class parallel (object):
+
+    def __init__ (self, processes = None):
+        import multiprocessing
+        self.alpha = multiprocessing.Value('l', -0x7fffffff)
+        self.pool = multiprocessing.Pool(processes, _parallel_init, 
+                (self.alpha, ))
+        self.searcher = searcher()
+        self.nodes = 0
+        self.generation = 0
+
+    # 清空所有工作进程的置换表（在下一次搜索时生效）
+    def reset (self):
+        self.generation += 1
+        return self.generation
+
+    # 搜索：分数相同的走法可能和串行搜索选择不同；胜负已分时不像 searcher.search 
+    # 那样改用一层搜索的分数
+    def search (self, board, turn, depth = 3):
+        s = self.searcher
+        s.board = [ list(row) for row in board ]
+        move = s.threats(turn)
+        if move is not None:
+            return 9990, move[0], move[1]
+        s.searching = False
+        moves = s.genmove(turn)
+        self.alpha.value = -0x7fffffff
+        tasks = [ (s.board, turn, depth, row, col, self.generation) 
+                for score, row, col in moves ]
+        best, bestmove = -0x7fffffff, None
+        self.nodes = 0
+        # 按照走法顺序取回结果，分数相同时和串行搜索一样选择排在前面的走法
+        # 分数不超过工作进程使用的 alpha 时只是上界，可能超过 best 的话在
+        # 本进程用 best 作为 alpha 重新搜索
+        for score, nodes, row, col, alpha in self.pool.imap(_parallel_move, 
+                tasks):
+            self.nodes += nodes
+            if score <= alpha and score > best:
+                score = s.searchmove(turn, depth, row, col, best)
+                self.nodes += s.nodes
+            if score > best:
+                best, bestmove = score, (row, col)
+        return best, bestmove[0], bestmove[1]
+
+    # 在一组固定局面上比较串行和并行搜索的耗时
+    def speedup (self, positions, turn = 2, depth = 3):
+        serial, total = 0.0, 0.0
+        for text in positions:
+            self.reset()
+            b = chessboard()
+            b.loads(text)
+            s = searcher()
+            s.board = b.board()
+            t = time.time()
+            s.search(turn, depth)
+            serial += time.time() - t
+            t = time.time()
+            self.search(b.board(), turn, depth)
+            total += time.time() - t
+        return serial, total, serial / max(total, 1e-9)
+
+    def close (self):
+        self.pool.terminate()
+        self.pool.join()
+        return 0
+
+
+# 工作进程：每个进程有自己的 searcher 和 evaluation
+_parallel_worker = None
+_parallel_alpha = None
+_parallel_generation = 0
+
+def _parallel_init (alpha):
+    global _parallel_worker, _parallel_alpha
+    _parallel_worker = searcher()
+    _parallel_alpha = alpha
+    return 0
+
+def _parallel_move (task):
+    global _parallel_generation
+    board, turn, depth, row, col, generation = task
+    s = _parallel_worker
+    if generation != _parallel_generation:
+        _parallel_generation = generation
+        if s.table is not None:
+            s.table.clear()
+    s.board = board
+    alpha = _parallel_alpha.value
+    score = s.searchmove(turn, depth, row, col, alpha)
+    with _parallel_alpha.get_lock():
+        if score > _parallel_alpha.value:
+            _parallel_alpha.value = score
+    return score, s.nodes, row, col, alpha
+
+
+#----------------------------------------------------------------------
+# ponder: 对手思考时，在后台线程里搜索预测的应对之后的局面
+# 对手走了预测的棋则直接使用结果，否则取消。同一时间只有一个线程在搜索
+#----------------------------------------------------------------------
+class ponder (object):
+
+    # 后台线程使用自己的直线棋型表和禁手检测，主线程检查禁手或者输赢时
+    # 写入的共享缓存不会和后台搜索同时修改
+    def __init__ (self, engine = None):
+        self.engine = engine = engine or searcher()
+        patterns = engine.evaluator.patterns
+        if patterns is not None:
+            patterns = patterns.copy()
+            engine.evaluator.patterns = patterns
+            engine.compact.patterns = patterns
+            if engine.incremental is not None:
+                engine.incremental.patterns = patterns
+        if engine.threat is not None:
+            patterns = engine.threat.patterns.copy()
+            engine.threat.patterns = engine.threat.evaluator.patterns = patterns
+        if engine.renju is not None:
+            engine.renju = renju(engine.size)
+        self.thread = None
+        self.move = None        # 预测的对手走法
+        self.result = None
+        self.elapsed = 0.0
+
+    # 预测 turn 方在 board 上的应对：主要变例太短时用一层搜索
+    def predict (self, board, turn):
+        engine = self.engine
+        engine.board = [ list(line) for line in board ]
+        score, row, col = engine.search(turn, 1)
+        return row, col
+
+    # board 是自己刚走完的棋盘，预测对手走 move（None 则调用 predict），
+    # 然后替 turn 方搜索
+    def start (self, board, move, turn, depth, budget = None):
+        import threading
+        self.cancel()
+        if move is None:
+            move = self.predict(board, turn == 1 and 2 or 1)
+        row, col = move
+        if board[row][col] != 0:
+            return False
+        engine = self.engine
+        engine.board = [ list(line) for line in board ]
+        engine.board[row][col] = turn == 1 and 2 or 1
+        self.move = (row, col)
+        self.result = None
+        def run ():
+            t = time.time()
+            try:
+                if budget is not None:
+                    result = engine.search(turn, 10, budget)
+                else:
+                    result = engine.search(turn, depth)
+            except Exception:
+                result = None
+            if not engine.stopped:
+                self.result = result
+            self.elapsed = time.time() - t
+        self.thread = threading.Thread(target = run)
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    # 对手实际走了 (row, col)：猜中则等待搜索结束并返回 (score, row, col)，
+    # 否则取消并返回 None
+    def take (self, row, col):
+        if self.thread is None:
+            return None
+        if self.move != (row, col):
+            self.cancel()
+            return None
+        self.thread.join()
+        self.thread = None
+        return self.result
+
+    # 取消后台搜索：搜索开始时会清除 stopped，所以反复设置直到线程结束
+    def cancel (self):
+        thread = self.thread
+        while thread is not None and thread.is_alive():
+            self.engine.stopped = True
+            thread.join(0.01)
+        self.thread = None
+        self.move = None
+        self.result = None
+        return 0
+
+
+#----------------------------------------------------------------------
+# openbook: 开局库，局面按 8 种对称变换折叠成规范哈希，排好序存到文件，
+# 用 mmap 二分查找，不需要把整个文件读进内存
+#----------------------------------------------------------------------
+class openbook (object):
+
+    MAGIC = b'GBBK'
+    VERSION = 1
+    HEADER = '<4sIII'       # 标识，版本，zobrist 种子，表项数
+    ENTRY = '<QBH'          # 规范哈希，规范坐标下的走法 (row * 尺寸 + col)，权重
+
+    # 开局库只用于 15 路棋盘，坐标、哈希和对称变换都取自对应的 geometry
+    def __init__ (self, seed = 0x6b616e67):
+        import struct
+        self.geometry = geo = shared_geometry(15)
+        self.size = N = geo.size
+        self.seed = seed
+        self.zobrist = zobrist(seed, N)
+        self.hsize = struct.calcsize(self.HEADER)
+        self.esize = struct.calcsize(self.ENTRY)
+        self.data = None
+        self.file = None
+        self.count = 0
+        # 8 种对称变换及其逆变换，见 geometry
+        self.SYMMETRY = geo.SYMMETRY
+        self.INVERSE = geo.INVERSE
+
+    # 规范哈希：8 种变换下取最小的哈希值，返回 (哈希, 变换编号)
+    def canonical (self, board, turn):
+        table, N = self.zobrist.table, self.size
+        stones = []
+        for i in range(N):
+            row = board[i]
+            for j in range(N):
+                if row[j]:
+                    stones.append((row[j], i * N + j))
+        best = None
+        for t in range(8):
+            symmetry = self.SYMMETRY[t]
+            key = self.zobrist.turn[turn]
+            for stone, k in stones:
+                n = symmetry[k]
+                key ^= table[stone][n // N][n % N]
+            if best is None or key < best[0]:
+                best = (key, t)
+        return best
+
+    # 打开开局库文件，失败返回 False
+    def open (self, filename):
+        import mmap, struct
+        self.close()
+        try:
+            fp = open(filename, 'rb')
+        except (IOError, OSError):
+            return False
+        try:
+            data = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            fp.close()
+            return False
+        if len(data) < self.hsize:
+            data.close()
+            fp.close()
+            return False
+        magic, version, seed, count = struct.unpack_from(self.HEADER, data, 0)
+        if magic != self.MAGIC or version != self.VERSION or seed != self.seed \
+                or len(data) < self.hsize + count * self.esize:
+            data.close()
+            fp.close()
+            return False
+        self.file, self.data, self.count = fp, data, count
+        return True
+
+    def close (self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+        self.file, self.data, self.count = None, None, 0
+        return 0
+
+    # 查找：返回 [(row, col, 权重)]，二分查找第一个哈希相同的表项
+    def lookup (self, board, turn):
+        import struct
+        if self.data is None:
+            return []
+        key, t = self.canonical(board, turn)
+        data, ENTRY, hsize, esize = self.data, self.ENTRY, self.hsize, self.esize
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) >> 1
+            if struct.unpack_from('<Q', data, hsize + middle * esize)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        inverse, N = self.INVERSE[t], self.size
+        moves = []
+        while low < self.count:
+            entry = struct.unpack_from(ENTRY, data, hsize + low * esize)
+            if entry[0] != key:
+                break
+            k = inverse[entry[1]]
+            i, j = k // N, k % N
+            if board[i][j] == 0:
+                moves.append((i, j, entry[2]))
+            low += 1
+        return moves
+
+    # 选择走法：rand 为空时取权重最大的，否则按权重随机；没有则返回 None
+    def choose (self, board, turn, rand = None):
+        moves = self.lookup(board, turn)
+        if not moves:
+            return None
+        if rand is None:
+            row, col, weight = max(moves, key = lambda m: (m[2], -m[0], -m[1]))
+            return row, col
+        total = sum([ m[2] for m in moves ])
+        point = rand.random() * total
+        for row, col, weight in moves:
+            point -= weight
+            if point < 0:
+                break
+        return row, col
+
+    # 从棋谱生成开局库：每行一盘棋，格式和 dumps() 相同，按落子顺序排列
+    # 记录前 plies 步的局面和下一步走法，出现次数少于 minimum 的走法丢弃
+    def build (self, records, filename, plies = 12, minimum = 1):
+        import struct, os
+        counter = {}
+        games, N = 0, self.size
+        for text in records:
+            text = text.strip('\r\n\t ')
+            if not text or text.startswith('#'):
+                continue
+            board = [ [ 0 for n in range(N) ] for m in range(N) ]
+            items = text.replace(',', ' ').split()
+            for item in items[:plies]:
+                stone, cord = item.split(':')
+                stone = int(stone)
+                i = ord(cord[0].upper()) - ord('A')
+                j = ord(cord[1].upper()) - ord('A')
+                if board[i][j] != 0:
+                    break
+                key, t = self.canonical(board, stone)
+                move = (key, self.SYMMETRY[t][i * N + j])
+                counter[move] = counter.get(move, 0) + 1
+                board[i][j] = stone
+            games += 1
+        entries = [ (key, move, min(weight, 0xffff)) for (key, move), weight 
+                in counter.items() if weight >= minimum ]
+        entries.sort()
+        # 先写到临时文件再改名：正在使用开局库的进程不会读到写了一半的
+        # 文件，中途失败时原来的开局库保持不变
+        temp = '%s.%d.tmp'%(filename, os.getpid())
+        try:
+            with open(temp, 'wb') as fp:
+                fp.write(struct.pack(self.HEADER, self.MAGIC, self.VERSION, 
+                    self.seed, len(entries)))
+                for entry in entries:
+                    fp.write(struct.pack(self.ENTRY, *entry))
+            os.rename(temp, filename)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+        return games, len(entries)
+
+
+# 开局库命令行：从棋谱生成，或者查询一个局面
+def bookmain(args = None):
+    import argparse
+    parser = argparse.ArgumentParser(prog = 'gobang.py book',
+            description = 'build an opening book from game records, one game '
+            'per line in dumps() format listed in move order')
+    parser.add_argument('files', nargs = '*', default = [], 
+            help = 'game record files, "-" for stdin')
+    parser.add_argument('--output', default = 'gobang.book')
+    parser.add_argument('--plies', type = int, default = 12,
+            help = 'number of opening moves taken from each game')
+    parser.add_argument('--min', type = int, default = 1, dest = 'minimum',
+            help = 'drop moves played in fewer games than this')
+    parser.add_argument('--probe', default = None, metavar = 'POSITION',
+            help = 'look up a position in the book given by --output')
+    parser.add_argument('--turn', type = int, choices = (1, 2), default = 2)
+    opts = parser.parse_args(args)
+    book = openbook()
+    if opts.probe is not None:
+        if not book.open(opts.output):
+            sys.stderr.write('can not open book %s\n'%opts.output)
+            return 1
+        b = chessboard()
+        b.loads(opts.probe)
+        for row, col, weight in book.lookup(b.board(), opts.turn):
+            print('%s%s %d'%(chr(ord('A') + row), chr(ord('A') + col), weight))
+        book.close()
+        return 0
+    def records ():
+        for name in opts.files or [ '-' ]:
+            if name.endswith('.gbr'):
+                for game in readgames(name):
+                    yield recordtext(game['moves'])
+                continue
+            fp = (name == '-') and sys.stdin or open(name)
+            for text in fp:
+                yield text
+            if fp is not sys.stdin:
+                fp.close()
+    games, entries = book.build(records(), opts.output, opts.plies, 
+            opts.minimum)
+    print('%d games, %d entries written to %s'%(games, entries, opts.output))
+    return 0
+
+
+#----------------------------------------------------------------------
+# gamerecord: 二进制棋谱。文件头以后是若干数据块，每块 (压缩后长度, 原始
+# 长度, 棋局数) 加上压缩数据（zlib，zstd 或者不压缩），可以逐块流式读写。
+# 每盘棋：(尺寸, 规则, 胜者, 先走的棋子, 走法数, 附加信息长度)，然后是附加
+# 信息（UTF-8）和走法；15 路以内每步一个字节 (行 * 尺寸 + 列)，更大的棋盘
+# 每步两个字节。双方交替落子，同一方连走时插入一个 PASS 保持无损
+#----------------------------------------------------------------------
+class recordwriter (object):
+
+    MAGIC = b'GBGR'
+    VERSION = 1
+    HEADER = '<4sHBB'       # 标识，版本，压缩方式，保留
+    BLOCK = '<III'          # 压缩后长度，原始长度，棋局数
+    GAME = '<BBBBHH'        # 尺寸，规则，胜者，先走的棋子，走法数，附加信息长度
+    COMPRESS = ('none', 'zlib', 'zstd')
+
+    # fp: 文件名或者以二进制写打开的文件；block: 每块原始数据的大小
+    def __init__ (self, fp, compress = 'zlib', block = 1 << 16, level = 6):
+        import struct
+        if compress not in self.COMPRESS:
+            raise ValueError('unknown compression: %s'%compress)
+        self.codec = _record_codec(compress, level)
+        self.owned = not hasattr(fp, 'write')
+        self.fp = self.owned and open(fp, 'wb') or fp
+        self.block = block
+        self.buffer = bytearray()
+        self.count = 0          # 当前块里的棋局数
+        self.games = 0          # 写入的棋局总数
+        self.fp.write(struct.pack(self.HEADER, self.MAGIC, self.VERSION, 
+            self.COMPRESS.index(compress), 0))
+
+    # 写入一盘棋：moves 是 [(棋子, 行, 列), ...] 或者 dumps() 格式的文本
+    # meta 为附加信息字符串，比如对局双方
+    def write (self, moves, winner = 0, size = 15, rules = 'freestyle', 
+            meta = None):
+        import struct
+        if not isinstance(moves, (list, tuple)):
+            moves = recordmoves(moves)
+        meta = (meta or '').encode('utf-8')
+        first = moves and moves[0][0] or 1
+        data = _record_encode(moves, first, size)
+        wide = size > 15 and 2 or 1
+        self.buffer += struct.pack(self.GAME, size, 
+                ruleset.NAMES.index(rules), winner, first, 
+                len(data) // wide, len(meta))
+        self.buffer += meta
+        self.buffer += data
+        self.count += 1
+        self.games += 1
+        if len(self.buffer) >= self.block:
+            self.flush()
+        return 0
+
+    # 压缩并写出当前块
+    def flush (self):
+        import struct
+        if self.count == 0:
+            return 0
+        raw = bytes(self.buffer)
+        data = self.codec[0](raw)
+        self.fp.write(struct.pack(self.BLOCK, len(data), len(raw), self.count))
+        self.fp.write(data)
+        self.buffer = bytearray()
+        self.count = 0
+        return 0
+
+    def close (self):
+        if self.fp is not None:
+            self.flush()
+            if self.owned:
+                self.fp.close()
+            else:
+                self.fp.flush()
+            self.fp = None
+        return 0
+
+
+# 压缩方式 -> (压缩函数, 解压函数)，zstd 需要安装 zstandard
+def _record_codec (compress, level = 6):
+    if compress == 'zlib':
+        import zlib
+        return (lambda data: zlib.compress(data, level), zlib.decompress)
+    if compress == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd compression needs the zstandard module')
+        return (zstandard.ZstdCompressor(level = level).compress, 
+                zstandard.ZstdDecompressor().decompress)
+    return (bytes, bytes)
+
+
+# 走法编码：PASS 表示同一方连走（跳过对方）
+def _record_encode (moves, first, size):
+    import array
+    data = array.array(size > 15 and 'H' or 'B')
+    skip = size > 15 and 0xffff or 0xff
+    expect = first
+    for stone, row, col in moves:
+        if stone != expect:
+            data.append(skip)
+            expect = stone
+        data.append(row * size + col)
+        expect = expect == 1 and 2 or 1
+    if sys.byteorder != 'little' and size > 15:
+        data.byteswap()
+    return data.tobytes()
+
+
+def _record_decode (data, first, size):
+    import array
+    data = array.array(size > 15 and 'H' or 'B', data)
+    if sys.byteorder != 'little' and size > 15:
+        data.byteswap()
+    skip = size > 15 and 0xffff or 0xff
+    moves = []
+    stone = first
+    for code in data:
+        if code == skip:
+            stone = stone == 1 and 2 or 1
+            continue
+        moves.append((stone, code // size, code % size))
+        stone = stone == 1 and 2 or 1
+    return moves
+
+
+# 流式读取棋谱文件，逐盘产生 { 'moves', 'winner', 'size', 'rules', 'meta' }
+# 每次只解压一块，内存占用和文件大小无关
+def readgames (fp):
+    import struct
+    owned = not hasattr(fp, 'read')
+    if owned:
+        fp = open(fp, 'rb')
+    try:
+        W = recordwriter
+        head = fp.read(struct.calcsize(W.HEADER))
+        if len(head) < struct.calcsize(W.HEADER):
+            raise ValueError('not a game record file')
+        magic, version, compress, reserved = struct.unpack(W.HEADER, head)
+        if magic != W.MAGIC or version != W.VERSION:
+            raise ValueError('not a game record file')
+        if compress >= len(W.COMPRESS):
+            raise ValueError('unknown compression')
+        decompress = _record_codec(W.COMPRESS[compress])[1]
+        bsize, gsize = struct.calcsize(W.BLOCK), struct.calcsize(W.GAME)
+        while True:
+            head = fp.read(bsize)
+            if not head:
+                break
+            if len(head) < bsize:
+                raise ValueError('truncated block header')
+            stored, length, count = struct.unpack(W.BLOCK, head)
+            data = fp.read(stored)
+            if len(data) < stored:
+                raise ValueError('truncated block')
+            data = decompress(data)
+            if len(data) != length:
+                raise ValueError('corrupted block')
+            pos = 0
+            for n in range(count):
+                size, rules, winner, first, num, metalen = \
+                        struct.unpack_from(W.GAME, data, pos)
+                pos += gsize
+                meta = data[pos:pos + metalen].decode('utf-8')
+                pos += metalen
+                wide = size > 15 and 2 or 1
+                moves = _record_decode(data[pos:pos + num * wide], first, size)
+                pos += num * wide
+                yield { 'moves': moves, 'winner': winner, 'size': size,
+                        'rules': ruleset.NAMES[rules], 'meta': meta }
+    finally:
+        if owned:
+            fp.close()
+
+
+# 流式产生每盘棋的每个局面：(棋局, 步数, chessboard)，chessboard 是落下第
+# 步数 步以后的棋盘（同一盘棋复用同一个对象，需要保存时请复制）
+def readpositions (fp):
+    boards = {}
+    for game in readgames(fp):
+        key = (game['size'], game['rules'])
+        b = boards.get(key)
+        if b is None:
+            b = boards[key] = chessboard(size = game['size'], 
+                    rules = game['rules'])
+        b.reset()
+        ply = 0
+        yield game, ply, b
+        for stone, row, col in game['moves']:
+            b.make_move(row, col, stone)
+            ply += 1
+            yield game, ply, b
+
+
+# dumps() 格式（按照走子顺序）的文本转换为 [(棋子, 行, 列), ...]
+def recordmoves (text):
+    moves = []
+    for item in text.strip('\r\n\t ').replace(',', ' ').split(' '):
+        n = item.strip('\r\n\t ')
+        if not n: continue
+        n = n.split(':')
+        moves.append((int(n[0]), ord(n[1][0].upper()) - ord('A'), 
+            ord(n[1][1].upper()) - ord('A')))
+    return moves
+
+
+# [(棋子, 行, 列), ...] 转换为 dumps() 格式的文本
+def recordtext (moves):
+    return ''.join([ '%d:%s%s '%(stone, chr(ord('A') + row), 
+        chr(ord('A') + col)) for stone, row, col in moves ])
+
+
+# 文本棋谱和二进制棋谱互相转换，或者统计
+def recordmain(args = None):
+    import argparse
+    parser = argparse.ArgumentParser(prog = 'gobang.py record',
+            description = 'convert game records between dumps() text '
+            '(one game per line, in move order) and the binary format')
+    parser.add_argument('action', choices = ('pack', 'unpack', 'stat'))
+    parser.add_argument('files', nargs = '*', default = [], 
+            help = 'input files, "-" for stdin (pack only)')
+    parser.add_argument('--output', default = None, 
+            help = 'output file (default: stdout for unpack)')
+    parser.add_argument('--compress', default = 'zlib', 
+            choices = recordwriter.COMPRESS)
+    parser.add_argument('--size', type = int, default = 15)
+    parser.add_argument('--rules', default = 'freestyle', 
+            choices = ruleset.NAMES)
+    opts = parser.parse_args(args)
+    if opts.action == 'pack':
+        if not opts.output:
+            sys.stderr.write('pack needs --output\n')
+            return 1
+        writer = recordwriter(opts.output, opts.compress)
+        for name in opts.files or [ '-' ]:
+            fp = (name == '-') and sys.stdin or open(name)
+            for text in fp:
+                if text.strip():
+                    writer.write(recordmoves(text), 0, opts.size, opts.rules)
+            if fp is not sys.stdin:
+                fp.close()
+        writer.close()
+        print('%d games written to %s'%(writer.games, opts.output))
+        return 0
+    fp = opts.output and open(opts.output, 'w') or sys.stdout
+    games, moves = 0, 0
+    for name in opts.files:
+        for game in readgames(name):
+            games += 1
+            moves += len(game['moves'])
+            if opts.action == 'unpack':
+                fp.write(recordtext(game['moves']).rstrip(' ') + '\n')
+    if opts.action == 'stat':
+        fp.write('%d games, %d moves\n'%(games, moves))
+    if fp is not sys.stdout:
+        fp.close()
+    return 0
+
+
+#----------------------------------------------------------------------
+# psyco speedup
+#----------------------------------------------------------------------
+def psyco_speedup ():
+    try:
+        import psyco
+        psyco.bind(chessboard)
+        psyco.bind(evaluation)
+    except:
+        pass
+    return 0
+
+psyco_speedup()
+
+
+#----------------------------------------------------------------------
+# main game
+#----------------------------------------------------------------------
+# 开局：游戏和自我对弈都从其中之一开始
+OPENINGS = [
+    '1:HH 2:II',
+    #'2:IG 2:GI 1:HH',
+    '1:IH 2:GI',
+    '1:HG 2:HI',
+    #'2:HG 2:HI 1:HH',
+    #'1:HH 2:IH 2:GI',
+    #'1:HH 2:IH 2:HI',
+    #'1:HH 2:IH 2:HJ',
+    #'1:HG 2:HH 2:HI',
+    #'1:GH 2:HH 2:HI',
+]
+
+def gamemain(budget = None):
+    # 设置难度：固定深度，或者每步的思考时间（秒）；ponder 打开后台思考
+    # 19x19 之类设置棋盘尺寸，freestyle/standard/renju 设置规则
+    DEPTH = 1
+    pondering = False
+    size, rules = 15, 'freestyle'
+
+    for arg in sys.argv[1:]:
+        if arg.lower() == 'hard':
+            DEPTH = 2
+        elif arg.lower() == 'ponder':
+            pondering = True
+        elif arg.lower() in ruleset.NAMES:
+            rules = arg.lower()
+        elif arg.lower().count('x') == 1 and arg.lower().split('x')[0].isdigit():
+            size = int(arg.lower().split('x')[0])
+        else:
+            try: budget = float(arg)
+            except ValueError: pass
+
+    b = chessboard(size = size, rules = rules)
+    s = searcher(size, rules)
+    s.board = b.board()
+    pondering = pondering and ponder(searcher(size, rules)) or None
+
+    opening = OPENINGS
+
+    import random, os
+    openid = random.randint(0, len(opening) - 1)
+
+    # 开局库：环境变量 GOBANG_BOOK 指定，默认使用程序目录下的 gobang.book
+    # 开局库只有 15 路的棋局
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+            'gobang.book')
+    book = openbook()
+    if size != book.size or not book.open(os.environ.get('GOBANG_BOOK', default)):
+        book = None
+    # 开局摆在棋盘中央
+    base = chessboard()
+    base.loads(opening[openid])
+    offset = (size - 15) // 2
+    for i in range(15):
+        for j in range(15):
+            if base[i][j]:
+                b.put(i + offset, j + offset, base[i][j])
+    b.sync()
+    turn = 2
+    undo = False
+
+    while 1:
+        print('')
+        while 1:
+            print('<ROUND %d>'%(len(b.stack) // 2 + 1))
+            b.show()
+            print('Your move (u:undo, q:quit):', end='')
+            text = input().strip('\r\n\t ')
+            if len(text) == 2:
+                tr = ord(text[0].upper()) - ord('A')
+                tc = ord(text[1].upper()) - ord('A')
+                if tr >= 0 and tc >= 0 and tr < size and tc < size:
+                    if b[tr][tc] != 0:
+                        print('can not move there')
+                    elif b.rules.forbidden(b.board(), tr, tc):
+                        print('forbidden move')
+                    else:
+                        row, col = tr, tc
+                        break
+                else:
+                    print('bad position')
+            elif text.upper() == 'U':
+                undo = True
+                break
+            elif text.upper() == 'Q':
+                if pondering is not None:
+                    pondering.cancel()
+                print(b.dumps())
+                return 0
+        
+        if undo == True:
+            if pondering is not None:
+                pondering.cancel()
+            undo = False
+            if len(b.stack) < 2:
+                print('no history to undo')
+            else:
+                print('rollback from history ...')
+                b.unmake_move()
+                b.unmake_move()
+        else:
+            b.make_move(row, col, 1)
+
+            if b.checkmove(row, col) == 1:
+                b.show()
+                print(b.dumps())
+                print('')
+                print('YOU WIN !!')
+                return 0
+
+            move = book is not None and book.choose(b.board(), 2, random) \
+                    or None
+            result = None
+            if pondering is not None:
+                result = pondering.take(row, col)
+            if move is not None:
+                row, col = move
+                cord = '%s%s'%(chr(ord('A') + row), chr(ord('A') + col))
+                print('robot move to %s (book)'%cord)
+            elif result is not None:
+                score, row, col = result
+                cord = '%s%s'%(chr(ord('A') + row), chr(ord('A') + col))
+                print('robot move to %s (%d, ponder hit)'%(cord, score))
+            else:
+                print('robot is thinking now ...')
+                if budget is not None:
+                    score, row, col = s.search(2, 10, budget)
+                else:
+                    score, row, col = s.search(2, DEPTH)
+                cord = '%s%s'%(chr(ord('A') + row), chr(ord('A') + col))
+                print('robot move to %s (%d)'%(cord, score))
+            b.make_move(row, col, 2)
+
+            if b.checkmove(row, col) == 2:
                 b.show()
                 print(b.dumps())
                 print('')
                 print('YOU LOSE.')
                 return 0
 
+            # 按照主要变例预测对手的应对（太短则由 predict 预测），在等待
+            # 输入时提前搜索
+            if pondering is not None:
+                pv = result is not None and pondering.engine.pv or s.pv
+                reply = None
+                if move is None and len(pv) >= 2 and pv[0] == (row, col):
+                    reply = pv[1]
+                pondering.start(b.board(), reply, 2, DEPTH, budget)
+
+    return 0
+
+
+#----------------------------------------------------------------------
+# batch: 批量分析，每行一个 dumps() 格式的局面，结果以 JSON 行输出
+#----------------------------------------------------------------------
+def batchmain(args = None):
+    import argparse, json, os
+    parser = argparse.ArgumentParser(prog = 'gobang.py batch',
+            description = 'analyse positions in dumps() format, one per line')
+    parser.add_argument('files', nargs = '*', default = [ '-' ],
+            help = 'input files, "-" for stdin (default)')
+    parser.add_argument('--mode', choices = ('search', 'evaluate'), 
+            default = 'search')
+    parser.add_argument('--turn', choices = ('1', '2', 'auto'), default = 'auto',
+            help = 'side to move, auto: side with fewer stones, black on ties')
+    parser.add_argument('--depth', type = int, default = 3)
+    parser.add_argument('--time', type = float, default = None,
+            help = 'time budget per position in seconds (iterative deepening)')
+    parser.add_argument('--nodes', type = int, default = None,
+            help = 'node budget per position (iterative deepening)')
+    parser.add_argument('--jobs', type = int, default = 1)
+    parser.add_argument('--chunk', type = int, default = 256,
+            help = 'positions held in memory at a time')
+    parser.add_argument('--output', default = '-')
+    parser.add_argument('--checkpoint', default = None,
+            help = 'record progress here and resume from it if it exists')
+    parser.add_argument('--eval-cache', default = None, dest = 'cache',
+            help = 'persistent evaluation cache file shared by the workers')
+    opts = parser.parse_args(args)
+
+    # 读取断点：已经完成的文件序号和行号
+    done = (0, 0)
+    if opts.checkpoint and os.path.exists(opts.checkpoint):
+        with open(opts.checkpoint) as fp:
+            state = json.load(fp)
+        if state.get('files') != opts.files:
+            sys.stderr.write('checkpoint was written for other input files\n')
+            return 1
+        done = tuple(state['position'])
+
+    config = (opts.mode, opts.turn, opts.depth, opts.time, opts.nodes,
+            opts.cache)
+    pool = None
+    if opts.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(opts.jobs, _batch_init, (config, ))
+    else:
+        _batch_init(config)
+
+    if opts.output == '-':
+        output = sys.stdout
+    else:
+        output = open(opts.output, done != (0, 0) and 'a' or 'w')
+
+    # 逐块处理：每块完成以后写出结果并记录断点
+    def flush (chunk, position):
+        if not chunk:
+            return 0
+        if pool is not None:
+            results = pool.map(_batch_analyse, chunk)
+        else:
+            results = [ _batch_analyse(task) for task in chunk ]
+        for record in results:
+            output.write(json.dumps(record, sort_keys = True) + '\n')
+        output.flush()
+        if opts.checkpoint:
+            temp = opts.checkpoint + '.tmp'
+            with open(temp, 'w') as fp:
+                json.dump({ 'files': opts.files, 'position': position }, fp)
+            if os.path.exists(opts.checkpoint):
+                os.remove(opts.checkpoint)
+            os.rename(temp, opts.checkpoint)
+        return len(results)
+
+    try:
+        for index, name in enumerate(opts.files):
+            if index < done[0]:
+                continue
+            fp = (name == '-') and sys.stdin or open(name)
+            chunk = []
+            lineno = 0
+            for text in fp:
+                lineno += 1
+                if index == done[0] and lineno <= done[1]:
+                    continue
+                text = text.strip('\r\n\t ')
+                if not text or text.startswith('#'):
+                    continue
+                chunk.append((name, lineno, text))
+                if len(chunk) >= opts.chunk:
+                    flush(chunk, [ index, lineno ])
+                    chunk = []
+            flush(chunk, [ index + 1, 0 ])
+            if fp is not sys.stdin:
+                fp.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+# 批量分析的工作函数，每个进程一个 searcher
+_batch_searcher = None
+_batch_config = None
+
+def _batch_init (config):
+    global _batch_searcher, _batch_config
+    _batch_searcher = searcher()
+    _batch_config = config
+    if config[5]:
+        _batch_searcher.cache = evalcache(filename = config[5])
+    return 0
+
+def _batch_analyse (task):
+    name, lineno, text = task
+    mode, turn, depth, timeout, nodes, cache = _batch_config
+    record = { 'file': name, 'line': lineno, 'position': text }
+    try:
+        b = chessboard()
+        b.loads(text)
+        if turn == 'auto':
+            stones = [ 0, 0, 0 ]
+            for row in b.board():
+                for stone in row:
+                    stones[stone] += 1
+            turn = (stones[1] > stones[2]) and 2 or 1
+        turn = int(turn)
+        record['turn'] = turn
+        t = time.time()
+        s = _batch_searcher
+        if mode == 'evaluate':
+            record['score'] = s.evaluator.evaluate(b.board(), turn)
+            record['move'] = None
+            record['depth'] = 0
+            record['nodes'] = 1
+        else:
+            s.board = b.board()
+            if timeout is None and nodes is None:
+                score, row, col = s.search(turn, depth)
+            else:
+                score, row, col = s.search(turn, depth, timeout, nodes)
+            record['score'] = score
+            record['move'] = chr(ord('A') + row) + chr(ord('A') + col)
+            record['depth'] = s.depth
+            record['nodes'] = s.nodes
+        record['time'] = round(time.time() - t, 6)
+    except Exception as e:
+        record['error'] = '%s: %s'%(type(e).__name__, e)
+    if _batch_searcher.cache is not None:
+        _batch_searcher.cache.flush()
+    return record
+
+
+#----------------------------------------------------------------------
+# server: 多局对弈服务，每行一个 JSON 请求/应答（TCP 或者 Unix socket）
+# 搜索交给进程池，事件循环只处理网络读写，慢的搜索不会阻塞其它连接
+#----------------------------------------------------------------------
+class gameserver (object):
+
+    # workers: 搜索进程数，queue: 同时排队和执行的搜索上限，超出则拒绝
+    # budget: 默认每次搜索的秒数，limit: 请求能够指定的最大秒数
+    # nodes: 请求能够指定的最大节点数
+    def __init__ (self, workers = None, queue = 64, budget = 1.0, 
+            limit = 10.0, depth = 10, games = 10000, cache = None, 
+            nodes = 10000000):
+        self.workers = workers
+        self.cache = cache      # 评估缓存文件，工作进程共享
+        self.queue = queue
+        self.budget = budget
+        self.limit = limit
+        self.depth = depth
+        self.maxnodes = nodes
+        self.maxgames = games
+        self.games = {}         # 对局编号 -> chessboard
+        self.winners = {}       # 对局编号 -> 胜方，0 表示未分胜负
+        self.searching = set()  # 正在搜索的对局
+        self.serial = 0
+        self.pending = 0        # 排队和执行中的搜索数
+        self.served = 0
+        self.rejected = 0
+        self.executor = None
+        self.loop = None
+
+    # 启动：unix 不为空时监听 Unix socket，否则监听 TCP
+    def start (self, loop, host = '127.0.0.1', port = 7777, unix = None):
+        import concurrent.futures
+        self.loop = loop
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        factory = lambda: gamesession(self)
+        if unix:
+            coroutine = loop.create_unix_server(factory, unix)
+        else:
+            coroutine = loop.create_server(factory, host, port)
+        return loop.run_until_complete(coroutine)
+
+    def close (self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = False)
+            self.executor = None
+        return 0
+
+    # 处理一个请求：返回应答 dict，或者返回搜索结果的 future
+    def dispatch (self, request):
+        command = request.get('cmd')
+        if command == 'ping':
+            return { 'pending': self.pending, 'games': len(self.games),
+                    'served': self.served, 'rejected': self.rejected }
+        if command == 'new':
+            if len(self.games) >= self.maxgames:
+                raise ValueError('too many games')
+            b = chessboard(size = int(request.get('size', 15)), 
+                    rules = str(request.get('rules', 'freestyle')))
+            for stone, row, col in _server_position(
+                    request.get('position', ''), b.size):
+                b.put(row, col, stone)
+            b.sync()
+            self.serial += 1
+            self.games[self.serial] = b
+            self.winners[self.serial] = b.check()
+            return { 'game': self.serial }
+        game = request.get('game')
+        if game not in self.games:
+            raise ValueError('unknown game')
+        b = self.games[game]
+        if game in self.searching:
+            raise ValueError('game is searching')
+        if command == 'show':
+            return { 'position': b.dumps(), 'winner': self.winners[game], 
+                    'size': b.size, 'rules': b.rules.name }
+        if command == 'close':
+            del self.games[game]
+            del self.winners[game]
+            return {}
+        if command == 'move':
+            row, col = _server_cord(request.get('move', ''), b.size)
+            stone = int(request.get('stone', 1))
+            if stone not in (1, 2) or b[row][col] != 0:
+                raise ValueError('illegal move')
+            if self.winners[game] != 0:
+                raise ValueError('game is over')
+            if stone == 1 and b.rules.forbidden(b.board(), row, col):
+                raise ValueError('forbidden move')
+            b.make_move(row, col, stone)
+            self.winners[game] = b.checkmove(row, col)
+            return { 'winner': self.winners[game] }
+        if command == 'search':
+            return self.__search(game, b, request)
+        raise ValueError('unknown command')
+
+    # 搜索请求放到进程池，队列已满则拒绝
+    def __search (self, game, b, request):
+        if self.pending >= self.queue:
+            self.rejected += 1
+            raise ValueError('busy')
+        if self.winners[game] != 0:
+            raise ValueError('game is over')
+        turn = int(request.get('turn', 2))
+        if turn not in (1, 2):
+            raise ValueError('bad turn')
+        budget = _server_number(request, 'time', self.budget, float, 
+                self.limit)
+        depth = _server_number(request, 'depth', self.depth, int, self.depth)
+        nodes = _server_number(request, 'nodes', None, int, self.maxnodes)
+        task = (b.dumps(), turn, depth, budget, nodes, self.cache, b.size, 
+                b.rules.name)
+        future = self.loop.run_in_executor(self.executor, _server_search, task)
+        self.pending += 1
+        self.searching.add(game)
+        play = request.get('play', False)
+        def done (future):
+            self.pending -= 1
+            self.searching.discard(game)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self.served += 1
+            result = future.result()
+            if play and game in self.games:
+                row, col = _server_cord(result['move'], b.size)
+                b.make_move(row, col, turn)
+                result['winner'] = self.winners[game] = b.checkmove(row, col)
+        future.add_done_callback(done)
+        return future
+
+
+# 一个连接：按行解析请求，同一连接的请求按顺序应答
+# 有搜索在进行或者写缓冲区已满时暂停读取，形成反压
+class gamesession (object):
+
+    MAXLINE = 1 << 16
+
+    def __init__ (self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b''
+        self.lines = []
+        self.waiting = False    # 等待搜索结果
+        self.blocked = False    # 写缓冲区已满
+        self.closed = False
+
+    def connection_made (self, transport):
+        self.transport = transport
+        return 0
+
+    def connection_lost (self, exc):
+        self.closed = True
+        return 0
+
+    def eof_received (self):
+        return None
+
+    def pause_writing (self):
+        self.blocked = True
+        self.__flow()
+
+    def resume_writing (self):
+        self.blocked = False
+        self.__flow()
+        self.__pump()
+
+    def data_received (self, data):
+        self.buffer += data
+        while True:
+            pos = self.buffer.find(b'\n')
+            if pos < 0:
+                break
+            self.lines.append(self.buffer[:pos])
+            self.buffer = self.buffer[pos + 1:]
+        if len(self.buffer) > self.MAXLINE:
+            self.__reply({}, { 'ok': False, 'error': 'line too long' })
+            self.transport.close()
+            return
+        self.__pump()
+
+    # 有积压的请求时不再读取新的数据
+    def __flow (self):
+        if self.closed:
+            return
+        if self.waiting or self.blocked or self.lines:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+
+    def __reply (self, request, response):
+        import json
+        if 'id' in request:
+            response['id'] = request['id']
+        if not self.closed:
+            data = json.dumps(response, sort_keys = True) + '\n'
+            self.transport.write(data.encode('utf-8'))
+
+    # 依次处理积压的请求，遇到搜索则等待结果
+    def __pump (self):
+        import json
+        while self.lines and not self.waiting and not self.blocked:
+            line = self.lines.pop(0).strip()
+            if not line:
+                continue
+            request = {}
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if not isinstance(request, dict):
+                    raise ValueError('request must be an object')
+                result = self.server.dispatch(request)
+            except Exception as e:
+                if not isinstance(request, dict):
+                    request = {}
+                self.__reply(request, { 'ok': False, 'error': str(e) })
+                continue
+            if isinstance(result, dict):
+                result['ok'] = True
+                self.__reply(request, result)
+                continue
+            self.waiting = True
+            result.add_done_callback(lambda f, r = request: self.__done(r, f))
+        self.__flow()
+
+    def __done (self, request, future):
+        self.waiting = False
+        if future.cancelled():
+            self.__reply(request, { 'ok': False, 'error': 'cancelled' })
+        elif future.exception() is not None:
+            self.__reply(request, { 'ok': False, 
+                'error': str(future.exception()) })
+        else:
+            result = dict(future.result())
+            result['ok'] = True
+            self.__reply(request, result)
+        self.__pump()
+
+
+def _server_cord (text, size = 15):
+    text = str(text).strip().upper()
+    if len(text) != 2:
+        raise ValueError('bad move')
+    row, col = ord(text[0]) - ord('A'), ord(text[1]) - ord('A')
+    if row < 0 or row >= size or col < 0 or col >= size:
+        raise ValueError('bad move')
+    return row, col
+
+
+# 解析 new 请求的局面：每项是 "棋子:坐标"，坐标不能超出棋盘或者重复
+def _server_position (text, size = 15):
+    moves, seen = [], set()
+    for item in str(text).replace(',', ' ').split():
+        parts = item.split(':')
+        try:
+            if len(parts) != 2 or parts[0] not in ('1', '2'):
+                raise ValueError('bad stone')
+            row, col = _server_cord(parts[1], size)
+        except ValueError:
+            raise ValueError('bad position item: %s'%item)
+        if (row, col) in seen:
+            raise ValueError('duplicate position item: %s'%item)
+        seen.add((row, col))
+        moves.append((int(parts[0]), row, col))
+    return moves
+
+
+# 请求里的数值参数：不是正数时报错，超过上限时截断，缺省为 None 时返回 None
+def _server_number (request, key, default, kind, limit):
+    value = request.get(key, default)
+    if value is None:
+        return None
+    try:
+        value = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('bad %s'%key)
+    if not value > 0:
+        raise ValueError('bad %s'%key)
+    return min(value, limit)
+
+
+# 服务进程池的工作函数，每个进程每种棋盘尺寸和规则一个 searcher
+_server_searchers = {}
+
+def _server_search (task):
+    text, turn, depth, budget, nodes, cache, size, rules = task
+    s = _server_searchers.get((size, rules))
+    if s is None:
+        s = _server_searchers[(size, rules)] = searcher(size, rules)
+        if cache:
+            s.cache = evalcache(filename = cache, boardsize = size, 
+                    rules = rules)
+    b = chessboard(size = size, rules = rules)
+    b.loads(text)
+    s.board = b.board()
+    t = time.time()
+    score, row, col = s.search(turn, depth, budget, nodes)
+    if s.cache is not None:
+        s.cache.flush()
+    return { 'move': chr(ord('A') + row) + chr(ord('A') + col), 
+            'score': score, 'depth': s.depth, 'nodes': s.nodes, 
+            'time': round(time.time() - t, 6) }
+
+
+def servermain(args = None):
+    import argparse, asyncio
+    parser = argparse.ArgumentParser(prog = 'gobang.py server',
+            description = 'serve games over line-delimited JSON')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 7777)
+    parser.add_argument('--unix', default = None, help = 'unix socket path')
+    parser.add_argument('--workers', type = int, default = None,
+            help = 'search processes (default: cpu count)')
+    parser.add_argument('--queue', type = int, default = 64,
+            help = 'searches queued or running before "busy" is returned')
+    parser.add_argument('--time', type = float, default = 1.0,
+            help = 'default time budget per search in seconds')
+    parser.add_argument('--max-time', type = float, default = 10.0, 
+            dest = 'limit', help = 'largest time budget a request may ask')
+    parser.add_argument('--depth', type = int, default = 10)
+    parser.add_argument('--max-nodes', type = int, default = 10000000,
+            dest = 'nodes', help = 'largest node limit a request may ask')
+    parser.add_argument('--games', type = int, default = 10000,
+            help = 'maximum number of open games')
+    parser.add_argument('--eval-cache', default = None, dest = 'cache',
+            help = 'persistent evaluation cache file shared by the workers')
+    opts = parser.parse_args(args)
+    loop = asyncio.new_event_loop()
+    server = gameserver(opts.workers, opts.queue, opts.time, opts.limit,
+            opts.depth, opts.games, opts.cache, opts.nodes)
+    listener = server.start(loop, opts.host, opts.port, opts.unix)
+    print('listening on %s'%(opts.unix or '%s:%d'%(opts.host, opts.port)))
+    sys.stdout.flush()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        server.close()
+        loop.close()
+    return 0
+
+
+# 压力测试：每个线程一个连接，引擎自己和自己下，统计每次搜索的延迟
+def loadtest (address, sessions = 8, moves = 10, budget = 0.2):
+    import socket, threading, random, json
+    latency, errors = [], []
+    lock = threading.Lock()
+    def session (index):
+        rand = random.Random(index)
+        if isinstance(address, tuple):
+            sock = socket.create_connection(address)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        fp = sock.makefile('rwb')
+        def call (request):
+            fp.write((json.dumps(request) + '\n').encode('utf-8'))
+            fp.flush()
+            return json.loads(fp.readline().decode('utf-8'))
+        try:
+            cord = chr(ord('F') + rand.randint(0, 4)) + \
+                    chr(ord('F') + rand.randint(0, 4))
+            game = call({ 'cmd': 'new', 'position': '1:' + cord })['game']
+            turn = 2
+            for n in range(moves):
+                t = time.time()
+                reply = call({ 'cmd': 'search', 'game': game, 'turn': turn,
+                    'time': budget, 'play': True })
+                with lock:
+                    if not reply.get('ok'):
+                        errors.append(reply.get('error'))
+                        continue
+                    latency.append(time.time() - t)
+                if reply.get('winner'):
+                    break
+                turn = 3 - turn
+            call({ 'cmd': 'close', 'game': game })
+        finally:
+            fp.close()
+            sock.close()
+    t = time.time()
+    threads = [ threading.Thread(target = session, args = (i, )) 
+            for i in range(sessions) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - t
+    latency.sort()
+    def percentile (p):
+        if not latency:
+            return 0.0
+        return latency[min(len(latency) - 1, int(len(latency) * p))]
+    return { 'searches': len(latency), 'errors': len(errors), 
+            'elapsed': elapsed, 'throughput': len(latency) / elapsed,
+            'p50': percentile(0.5), 'p95': percentile(0.95), 
+            'max': latency and latency[-1] or 0.0 }
+
+
+def loadtestmain(args = None):
+    import argparse, json
+    parser = argparse.ArgumentParser(prog = 'gobang.py loadtest',
+            description = 'play engine-vs-engine games against a local server')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 7777)
+    parser.add_argument('--unix', default = None)
+    parser.add_argument('--sessions', type = int, default = 8)
+    parser.add_argument('--moves', type = int, default = 10)
+    parser.add_argument('--time', type = float, default = 0.2)
+    opts = parser.parse_args(args)
+    address = opts.unix or (opts.host, opts.port)
+    result = loadtest(address, opts.sessions, opts.moves, opts.time)
+    print(json.dumps(result, indent = 2, sort_keys = True))
+    return result['errors'] and 1 or 0
+
+
+#----------------------------------------------------------------------
+# benchmark: 固定局面集上测量评估和搜索的速度，结果可以和基准文件对比
+#----------------------------------------------------------------------
+BENCHMARK = (
+    ('opening', 2, '1:HG 1:HH 1:IG 2:IH 2:II 2:JF'),
+    ('opening', 2, '1:GH 2:GI 2:GJ 2:HH 1:HI 1:IH'),
+    ('opening', 2, '1:HG 2:HI 1:IG 2:IH 2:JG 1:JH'),
+    ('opening', 2, '1:GI 1:HH 2:HI 2:II 2:JI 1:KI'),
+    ('midgame', 2, '2:EH 1:FG 1:FH 1:GF 2:GH 2:GI 1:HE 2:HF 2:HG 2:HH 2:HI '
+        '1:HJ 2:IE 1:IF 1:IG 1:IH 1:II 2:IJ 1:JF 2:JG 1:JH 2:KG 1:KH 2:LH'),
+    ('midgame', 2, '2:EK 2:FG 1:FJ 1:GC 2:GE 1:GH 1:GI 2:HD 1:HF 1:HG 1:HH '
+        '2:HI 2:IE 1:IG 2:IH 2:II 2:IJ 2:JF 1:JG 1:JH 2:JI 2:KG 1:KH 1:LH'),
+    ('midgame', 2, '2:CE 2:CK 1:DF 1:DK 2:DL 1:EG 1:EI 1:EK 2:FG 1:FH 1:FI '
+        '1:FJ 1:FK 2:FL 1:GD 2:GE 2:GF 2:GG 2:GH 1:GI 1:GK 2:HG 1:HH 2:HJ '
+        '2:HK 2:IG 1:JG 2:AA'),
+    ('tactical', 2, '2:DK 2:EH 1:EJ 1:FG 1:FI 1:FJ 2:GF 2:GG 1:GH 1:GI 1:GJ '
+        '2:GK 2:HE 2:HF 1:HG 2:HH 2:HI 2:IF 1:IG 2:IH 1:JF 2:JG 1:JH 1:KH'),
+    ('tactical', 2, '1:GF 1:GG 2:HG 1:HH 1:HI 1:IF 2:IG 2:IH 2:II 1:IJ 2:JG '
+        '2:JH 2:JI 1:JJ 2:KG 2:KJ 1:LG 1:LK'),
+    ('tactical', 2, '1:CJ 2:DJ 1:DK 1:DL 1:EH 1:EI 2:EJ 2:EK 2:FH 2:FI 2:FJ '
+        '1:FK 2:FL 1:FM 2:GF 1:GG 2:GH 2:GI 2:GJ 1:GK 1:GL 2:GM 1:HE 2:HF '
+        '2:HG 2:HH 2:HI 1:HJ 2:HK 2:HL 1:IF 1:IG 1:IH 2:II 1:IJ 2:IL 2:JG '
+        '1:JH 1:JI 1:JJ 1:JK 2:JL 1:JM 1:KI 2:KJ 1:KL 1:LJ 2:MK'),
+)
+
+
+# 统计：平均值，中位数，标准差，最小值，最大值
+def _bench_stats (samples, unit, better):
+    samples = sorted(samples)
+    n = len(samples)
+    mean = sum(samples) / float(n)
+    median = samples[n // 2]
+    if n % 2 == 0:
+        median = (samples[n // 2 - 1] + samples[n // 2]) / 2.0
+    stdev = 0.0
+    if n > 1:
+        stdev = (sum([ (x - mean) ** 2 for x in samples ]) / (n - 1)) ** 0.5
+    return { 'mean': mean, 'median': median, 'stdev': stdev, 
+            'min': samples[0], 'max': samples[-1], 'samples': n,
+            'unit': unit, 'better': better }
+
+
+# 运行所有测试，返回 { 指标名: 统计结果 }
+def benchmark (repeat = 5, warmup = 1, depth = 3, corpus = BENCHMARK):
+    clock = getattr(time, 'perf_counter', time.time)
+    boards = []
+    for category, turn, text in corpus:
+        b = chessboard()
+        b.loads(text)
+        boards.append((category, turn, b.board()))
+    samples = {}
+    def measure (name, value):
+        samples.setdefault(name, []).append(value)
+    for iteration in range(warmup + repeat):
+        record = iteration >= warmup
+        # 全盘评估
+        e = evaluation()
+        t = clock()
+        calls = 0
+        for category, turn, board in boards:
+            for i in range(50):
+                e.evaluate(board, 1)
+                e.evaluate(board, 2)
+            calls += 100
+        if record:
+            measure('evaluate.calls_per_sec', calls / (clock() - t))
+        # 增量评估：在每个候选点落子，打分，再提子
+        inc = incremental(e)
+        s = searcher()
+        t = clock()
+        calls = 0
+        for category, turn, board in boards:
+            s.board = board
+            inc.load(board)
+            for score, row, col in s.genmove(turn):
+                inc.apply(row, col, turn)
+                inc.evaluate(turn)
+                inc.undo(row, col)
+                calls += 1
+        if record:
+            measure('incremental.calls_per_sec', calls / (clock() - t))
+        # 搜索：关闭威胁空间搜索，测量 alpha-beta 本身的速度
+        for d in range(1, depth + 1):
+            elapsed, nodes = {}, {}
+            for category, turn, board in boards:
+                s = searcher()
+                s.threat = None
+                s.board = [ list(row) for row in board ]
+                t = clock()
+                s.search(turn, d)
+                elapsed[category] = elapsed.get(category, 0) + clock() - t
+                nodes[category] = nodes.get(category, 0) + s.nodes
+            if record:
+                measure('search.time_to_depth.%d'%d, sum(elapsed.values()))
+                if d == depth:
+                    for category in elapsed:
+                        measure('search.nodes_per_sec.%s'%category, 
+                                nodes[category] / elapsed[category])
+        # 连珠规则：黑棋先走，测量禁手检测摊到每个节点的开销（微秒）
+        elapsed, nodes, cost = 0.0, 0, 0.0
+        for category, turn, board in boards:
+            s = searcher(rules = 'renju')
+            s.threat = None
+            s.stats = statistics()
+            s.renju.reset()
+            s.board = [ list(row) for row in board ]
+            t = clock()
+            s.search(1, min(depth, 2))
+            elapsed += clock() - t
+            nodes += s.nodes
+            cost += s.stats.forbidtime
+        if record:
+            measure('renju.nodes_per_sec', nodes / elapsed)
+            measure('renju.forbidden_us_per_node', cost * 1000000.0 / nodes)
+        # 威胁空间搜索
+        solver = threat()
+        t = clock()
+        for category, turn, board in boards:
+            if category == 'tactical':
+                solver.cache.clear()
+                solver.solve(board, turn, False)
+                solver.solve(board, turn, True)
+        if record:
+            measure('threat.solve_time', clock() - t)
+    # 搜索时的内存峰值：tracemalloc 会让搜索慢很多倍，只测一次，深度不超过 2
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        for category, turn, board in boards:
+            s = searcher()
+            s.threat = None
+            s.board = [ list(row) for row in board ]
+            s.search(turn, min(depth, 2))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measure('memory.search_peak_kb', peak / 1024.0)
+    results = {}
+    for name, values in samples.items():
+        if '_per_sec' in name:
+            unit = name.split('.')[1] == 'nodes_per_sec' and 'nodes/s' or 'calls/s'
+            better = 'higher'
+        elif name.startswith('memory'):
+            unit, better = 'KiB', 'lower'
+        elif name.endswith('_us_per_node'):
+            unit, better = 'us', 'lower'
+        else:
+            unit, better = 's', 'lower'
+        results[name] = _bench_stats(values, unit, better)
+    return results
+
+
+# 走法排序选项对比：每种组合搜索全部局面，返回 [(名称, 节点数, 秒数, 分数列表)]
+# timeout 不为空时使用迭代加深
+def benchordering (depth = 3, corpus = BENCHMARK, timeout = None):
+    clock = getattr(time, 'perf_counter', time.time)
+    options = ('hashmove', 'killer', 'history', 'pvs')
+    configs = [ ('plain', ()) ]
+    configs.extend([ (name, (name,)) for name in options ])
+    configs.append(('all', options))
+    result = []
+    for name, enabled in configs:
+        nodes, elapsed, scores = 0, 0.0, []
+        for category, turn, text in corpus:
+            b = chessboard()
+            b.loads(text)
+            s = searcher()
+            s.threat = None
+            s.board = b.board()
+            for option in options:
+                setattr(s, option, option in enabled)
+            t = clock()
+            score, row, col = s.search(turn, depth, timeout)
+            elapsed += clock() - t
+            nodes += s.nodes
+            scores.append(score)
+        result.append((name, nodes, elapsed, scores))
+    return result
+
+
+# 和基准结果对比（按中位数），返回 (报告文本, 退步的指标数)
+def benchcompare (current, baseline, threshold = 0.1):
+    lines, regressions = [], 0
+    for name in sorted(current):
+        now = current[name]
+        if name not in baseline:
+            lines.append('%-36s %12.3f %s (new)'%(name, now['median'], now['unit']))
+            continue
+        old = baseline[name]['median']
+        ratio = old and now['median'] / old or 0.0
+        worse = now['better'] == 'higher' and ratio < 1 - threshold or \
+                now['better'] == 'lower' and ratio > 1 + threshold
+        if worse:
+            regressions += 1
+        lines.append('%-36s %12.3f %-8s %6.2fx%s'%(name, now['median'], 
+            now['unit'], ratio, worse and '  REGRESSION' or ''))
+    return '\n'.join(lines), regressions
+
+
+def benchmain(args = None):
+    import argparse, json, platform
+    parser = argparse.ArgumentParser(prog = 'gobang.py bench',
+            description = 'measure evaluator and searcher throughput')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--warmup', type = int, default = 1)
+    parser.add_argument('--depth', type = int, default = 3)
+    parser.add_argument('--output', default = None, help = 'write JSON results')
+    parser.add_argument('--baseline', default = None, 
+            help = 'compare against saved JSON results')
+    parser.add_argument('--threshold', type = float, default = 0.1,
+            help = 'relative change counted as a regression')
+    parser.add_argument('--ordering', action = 'store_true',
+            help = 'compare move ordering options by node count')
+    parser.add_argument('--deepening', action = 'store_true',
+            help = 'use iterative deepening with --ordering')
+    opts = parser.parse_args(args)
+    if opts.ordering:
+        timeout = opts.deepening and 3600.0 or None
+        result = benchordering(opts.depth, BENCHMARK, timeout)
+        plain = result[0][1]
+        for name, nodes, elapsed, scores in result:
+            same = scores == result[0][3] and 'same' or 'DIFFERENT'
+            print('%-10s %10d nodes %6.2fx %8.3fs  scores %s'%(name, nodes,
+                float(nodes) / plain, elapsed, same))
+        return 0
+    results = benchmark(opts.repeat, opts.warmup, opts.depth)
+    data = { 'meta': { 'python': platform.python_version(), 
+                'platform': platform.platform(), 'repeat': opts.repeat,
+                'warmup': opts.warmup, 'depth': opts.depth },
+            'results': results }
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            json.dump(data, fp, indent = 2, sort_keys = True)
+    baseline = {}
+    if opts.baseline:
+        with open(opts.baseline) as fp:
+            baseline = json.load(fp)['results']
+    text, regressions = benchcompare(results, baseline, opts.threshold)
+    print(text)
+    return regressions and 1 or 0
+
+
+#----------------------------------------------------------------------
+# match: 自我对弈，两种 searcher 配置轮流执黑执白，统计胜负和 Elo 差
+#----------------------------------------------------------------------
+
+# 配置能够设置的选项：搜索限制和 searcher 的同名开关
+MATCHOPTIONS = ('depth', 'time', 'nodes', 'pvs', 'hashmove', 'killer', 
+        'history', 'radius', 'vcf', 'vct')
+
+
+# 解析配置 "depth=2,time=0.5,pvs=1"：depth/time/nodes 是搜索参数，
+# 其它是 searcher 的属性；不在 MATCHOPTIONS 里的选项报 ValueError
+def matchconfig (text):
+    config = {}
+    for item in text.replace(' ', '').split(','):
+        if not item:
+            continue
+        if '=' not in item:
+            raise ValueError('bad option: %s'%item)
+        key, value = item.split('=', 1)
+        if key not in MATCHOPTIONS:
+            raise ValueError('unknown option: %s (supported: %s)'%(key, 
+                ', '.join(MATCHOPTIONS)))
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError('bad value for %s: %s'%(key, value))
+        config[key] = value
+    return config
+
+
+
+# Elo 差和 95% 置信区间：返回 (差值, 下限, 上限)，全胜或者全负等无法
+# 估计的值为 None（JSON 里是 null）
+def matchelo (wins, losses, draws):
+    import math
+    total = wins + losses + draws
+    if total == 0:
+        return 0.0, 0.0, 0.0
+    def elo (p):
+        if p <= 0 or p >= 1:
+            return None
+        return -400.0 * math.log10(1.0 / p - 1.0)
+    p = (wins + draws * 0.5) / total
+    variance = (wins * (1 - p) ** 2 + draws * (0.5 - p) ** 2 + 
+            losses * p ** 2) / total
+    margin = 1.96 * math.sqrt(variance / total)
+    return elo(p), elo(p - margin), elo(p + margin)
+
+
+# 对弈进程：每个进程按配置缓存 searcher
+_match_searchers = {}
+
+# 按照配置文本取得 searcher 并设置选项，返回 (searcher, 配置)
+def _match_engine (text):
+    s = _match_searchers.get(text)
+    if s is None:
+        s = _match_searchers[text] = searcher()
+    config = matchconfig(text)
+    for key, value in config.items():
+        if key not in ('depth', 'time', 'nodes'):
+            setattr(s, key, value)
+    return s, config
+
+# 按照配置的深度、时间或者节点数搜索 s.board
+def _match_think (s, config, turn):
+    if 'time' in config or 'nodes' in config:
+        return s.search(turn, config.get('depth', 10), config.get('time'), 
+                config.get('nodes'))
+    return s.search(turn, config.get('depth', 2))
+
+def _match_game (task):
+    index, opening, black, white, maxmoves = task
+    b = chessboard()
+    b.loads(opening)
+    moves = [ item for item in opening.replace(',', ' ').split() ]
+    stones = [ 0, 0, 0 ]
+    for i in range(15):
+        for j in range(15):
+            stones[b[i][j]] += 1
+    turn = stones[1] <= stones[2] and 1 or 2
+    players = { 1: black, 2: white }
+    spent = { 1: [ 0.0, 0, 0 ], 2: [ 0.0, 0, 0 ] }  # 时间，节点数，步数
+    winner = 0
+    for n in range(maxmoves):
+        if stones[0] == 0:
+            break
+        s, config = _match_engine(players[turn])
+        s.board = [ list(row) for row in b.board() ]
+        t = time.time()
+        score, row, col = _match_think(s, config, turn)
+        spent[turn][0] += time.time() - t
+        spent[turn][1] += s.nodes
+        spent[turn][2] += 1
+        b.make_move(row, col, turn)
+        stones[0] -= 1
+        moves.append('%d:%s%s'%(turn, chr(ord('A') + row), chr(ord('A') + col)))
+        if b.checkmove(row, col):
+            winner = turn
+            break
+        turn = turn == 1 and 2 or 1
+    return { 'index': index, 'opening': opening, 'black': black, 
+            'white': white, 'winner': winner, 'moves': ' '.join(moves),
+            'spent': spent }
+
+
+# 对弈：每个开局下两盘，双方交换颜色。返回 (统计结果, 每盘的记录)
+def tournament (first, second, openings = None, games = 2, jobs = 1, 
+        maxmoves = 120):
+    openings = openings or [ n for n in OPENINGS ]
+    tasks = []
+    for index in range(games):
+        opening = openings[(index // 2) % len(openings)]
+        if index % 2 == 0:
+            tasks.append((index, opening, first, second, maxmoves))
+        else:
+            tasks.append((index, opening, second, first, maxmoves))
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            records = pool.map(_match_game, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        records = [ _match_game(task) for task in tasks ]
+    records.sort(key = lambda r: r['index'])
+    wins, losses, draws = 0, 0, 0
+    usage = { first: [ 0.0, 0, 0 ], second: [ 0.0, 0, 0 ] }
+    for record in records:
+        players = { 1: record['black'], 2: record['white'] }
+        if record['winner'] == 0:
+            draws += 1
+        elif players[record['winner']] == first:
+            wins += 1
+        else:
+            losses += 1
+        for stone in (1, 2):
+            for k in range(3):
+                usage[players[stone]][k] += record['spent'][stone][k]
+    diff, low, high = matchelo(wins, losses, draws)
+    result = { 'first': first, 'second': second, 'games': len(records), 
+            'wins': wins, 'losses': losses, 'draws': draws, 
+            'elo': diff, 'elo_low': low, 'elo_high': high }
+    for name, text in (('first', first), ('second', second)):
+        seconds, nodes, moves = usage[text]
+        result[name + '_time_per_move'] = moves and seconds / moves or 0.0
+        result[name + '_nodes_per_move'] = moves and float(nodes) / moves or 0.0
+    return result, records
+
+
+def matchmain(args = None):
+    import argparse, json
+    parser = argparse.ArgumentParser(prog = 'gobang.py match',
+            description = 'play two searcher configurations against each '
+            'other, e.g. --first depth=2 --second time=0.5,pvs=1')
+    parser.add_argument('--first', default = 'depth=1')
+    parser.add_argument('--second', default = 'depth=2')
+    parser.add_argument('--games', type = int, default = 6,
+            help = 'number of games, colours alternate every game')
+    parser.add_argument('--jobs', type = int, default = 1)
+    parser.add_argument('--openings', default = None,
+            help = 'file with one dumps() opening per line')
+    parser.add_argument('--max-moves', type = int, default = 120, 
+            dest = 'maxmoves', help = 'moves after the opening before a draw')
+    parser.add_argument('--record', default = None,
+            help = 'write each game as a dumps() move sequence, one per line')
+    opts = parser.parse_args(args)
+    for text in (opts.first, opts.second):
+        try:
+            matchconfig(text)
+        except ValueError as e:
+            parser.error(str(e))
+    openings = None
+    if opts.openings:
+        with open(opts.openings) as fp:
+            openings = [ n.strip() for n in fp if n.strip() and 
+                    not n.startswith('#') ]
+    result, records = tournament(opts.first, opts.second, openings, 
+            opts.games, opts.jobs, opts.maxmoves)
+    if opts.record and opts.record.endswith('.gbr'):
+        writer = recordwriter(opts.record)
+        for record in records:
+            writer.write(record['moves'], record['winner'], meta = '%s vs %s'%(
+                record['black'], record['white']))
+        writer.close()
+    elif opts.record:
+        with open(opts.record, 'w') as fp:
+            for record in records:
+                fp.write(record['moves'] + '\n')
+    print('%s vs %s: +%d -%d =%d'%(opts.first, opts.second, result['wins'],
+        result['losses'], result['draws']))
+    text = [ value is None and 'n/a' or '%+.1f'%value for value in 
+            (result['elo'], result['elo_low'], result['elo_high']) ]
+    print('elo %s (95%% %s .. %s)'%tuple(text))
+    for name in ('first', 'second'):
+        print('%-6s %.3fs %8.1f nodes per move'%(name, 
+            result[name + '_time_per_move'], result[name + '_nodes_per_move']))
+    print(json.dumps(result, sort_keys = True))
+    return 0
+
+
+#----------------------------------------------------------------------
+# training data: 自我对弈产生训练数据，逐个生成器串起来：对弈采样局面，
+# 对称扩充，有限缓冲区打乱，写入分片文件。各阶段只保存有限的数据
+#----------------------------------------------------------------------
+
+# 自我对弈进程：从随机开局开始，先随机走几步（在排序靠前的走法中选择），
+# 之后按照配置搜索；每个局面以概率 rate 采样，记录搜索分数，结束后补上结果
+def _train_game (task):
+    import random
+    index, seed, config, rate, skip, randomplies, maxmoves = task
+    rand = random.Random(seed)
+    b = chessboard()
+    b.loads(rand.choice(OPENINGS))
+    N = b.size
+    stones = [ 0, 0, 0 ]
+    for i in range(N):
+        for j in range(N):
+            stones[b[i][j]] += 1
+    turn = stones[1] <= stones[2] and 1 or 2
+    s, settings = _match_engine(config)
+    samples, winner = [], 0
+    for ply in range(maxmoves):
+        if stones[0] == 0:
+            break
+        s.board = [ list(row) for row in b.board() ]
+        if ply < randomplies:
+            moves = s.genmove(turn)[:4]
+            score, row, col = rand.choice(moves)
+        else:
+            score, row, col = _match_think(s, settings, turn)
+            if ply >= skip and rand.random() < rate:
+                position = [ (b[i][j], i, j) for i in range(N) 
+                        for j in range(N) if b[i][j] ]
+                samples.append({ 'stones': position, 'turn': turn, 
+                    'score': score, 'game': index, 'ply': ply })
+        b.make_move(row, col, turn)
+        stones[0] -= 1
+        if b.checkmove(row, col):
+            winner = turn
+            break
+        turn = turn == 1 and 2 or 1
+    for sample in samples:
+        sample['result'] = winner and (winner == sample['turn'] and 1 or -1)
+    return samples
+
+
+# 并行自我对弈，逐个产生采样局面；games 为 0 时一直运行。最多同时提交 
+# jobs * 2 盘，结果按照提交顺序产生，相同 seed 的结果相同
+def selfplay (games = 0, jobs = 1, config = 'depth=2', rate = 0.25, skip = 4,
+        randomplies = 4, maxmoves = 120, seed = 0):
+    def tasks ():
+        index = 0
+        while games <= 0 or index < games:
+            yield (index, seed * 1000003 + index, config, rate, skip, 
+                    randomplies, maxmoves)
+            index += 1
+    if jobs <= 1:
+        for task in tasks():
+            for sample in _train_game(task):
+                yield sample
+        return
+    import multiprocessing, collections
+    pool = multiprocessing.Pool(jobs)
+    pending = collections.deque()
+    try:
+        for task in tasks():
+            pending.append(pool.apply_async(_train_game, (task, )))
+            if len(pending) >= jobs * 2:
+                for sample in pending.popleft().get():
+                    yield sample
+        while pending:
+            for sample in pending.popleft().get():
+                yield sample
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# 对称扩充：每个局面产生 count 种对称变换（最多 8 种），记录变换编号
+def augment (samples, count = 8, size = 15):
+    symmetry = shared_geometry(size).SYMMETRY
+    for sample in samples:
+        for t in range(count):
+            table = symmetry[t]
+            data = dict(sample)
+            data['stones'] = [ (stone, table[i * size + j] // size, 
+                table[i * size + j] % size) 
+                for stone, i, j in sample['stones'] ]
+            data['symmetry'] = t
+            yield data
+
+
+# 用固定大小的缓冲区打乱顺序，同一盘棋的局面不会连在一起
+def shuffle (samples, buffer = 10000, seed = 0):
+    import random
+    rand = random.Random(seed)
+    pool = []
+    for sample in samples:
+        if len(pool) < buffer:
+            pool.append(sample)
+            continue
+        k = rand.randrange(buffer)
+        yield pool[k]
+        pool[k] = sample
+    rand.shuffle(pool)
+    for sample in pool:
+        yield sample
+
+
+# 分片写入：每个文件最多 shard 条 JSON，compress 为真时用 gzip 压缩
+# 文件名为 prefix-00000.jsonl(.gz)
+class shardwriter (object):
+
+    def __init__ (self, prefix, shard = 100000, compress = True):
+        self.prefix = prefix
+        self.shard = shard
+        self.compress = compress
+        self.fp = None
+        self.index = 0          # 下一个分片编号
+        self.count = 0          # 当前分片的条数
+        self.total = 0
+        self.files = []
+
+    def write (self, sample):
+        import json
+        if self.fp is None or self.count >= self.shard:
+            self.__rotate()
+        data = { 'position': recordtext(sample['stones']).rstrip(' '), 
+                'turn': sample['turn'], 'score': sample['score'], 
+                'result': sample['result'], 'game': sample['game'], 
+                'ply': sample['ply'], 'symmetry': sample.get('symmetry', 0) }
+        line = json.dumps(data, sort_keys = True) + '\n'
+        self.fp.write(line.encode('utf-8'))
+        self.count += 1
+        self.total += 1
+        return 0
+
+    def __rotate (self):
+        self.close()
+        name = '%s-%05d.jsonl'%(self.prefix, self.index)
+        if self.compress:
+            import gzip
+            name += '.gz'
+            self.fp = gzip.open(name, 'wb')
+        else:
+            self.fp = open(name, 'wb')
+        self.files.append(name)
+        self.index += 1
+        self.count = 0
+        return 0
+
+    def close (self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        return 0
+
+
+def trainmain(args = None):
+    import argparse, os
+    parser = argparse.ArgumentParser(prog = 'gobang.py train',
+            description = 'generate (position, search score, game result) '
+            'training data from parallel self-play')
+    parser.add_argument('--output', default = 'train', 
+            help = 'shard file prefix, may include a directory')
+    parser.add_argument('--games', type = int, default = 100,
+            help = 'number of self-play games, 0 runs until interrupted')
+    parser.add_argument('--jobs', type = int, default = 1)
+    parser.add_argument('--config', default = 'depth=2', 
+            help = 'searcher configuration, same syntax as match')
+    parser.add_argument('--rate', type = float, default = 0.25,
+            help = 'probability of sampling each searched position')
+    parser.add_argument('--skip', type = int, default = 4,
+            help = 'plies after the opening that are never sampled')
+    parser.add_argument('--random', type = int, default = 4, 
+            dest = 'randomplies', help = 'random plies after the opening')
+    parser.add_argument('--max-moves', type = int, default = 120, 
+            dest = 'maxmoves')
+    parser.add_argument('--symmetry', type = int, default = 8, 
+            choices = range(1, 9), help = 'symmetric copies of each sample')
+    parser.add_argument('--shuffle', type = int, default = 10000,
+            help = 'shuffle buffer size, 0 keeps the generation order')
+    parser.add_argument('--shard', type = int, default = 100000,
+            help = 'samples per shard file')
+    parser.add_argument('--no-gzip', action = 'store_false', 
+            dest = 'compress')
+    parser.add_argument('--seed', type = int, default = 0)
+    opts = parser.parse_args(args)
+    try:
+        matchconfig(opts.config)
+    except ValueError as e:
+        parser.error(str(e))
+    folder = os.path.dirname(opts.output)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    samples = selfplay(opts.games, opts.jobs, opts.config, opts.rate, 
+            opts.skip, opts.randomplies, opts.maxmoves, opts.seed)
+    samples = augment(samples, opts.symmetry)
+    if opts.shuffle > 0:
+        samples = shuffle(samples, opts.shuffle, opts.seed)
+    writer = shardwriter(opts.output, opts.shard, opts.compress)
+    t = time.time()
+    try:
+        for sample in samples:
+            writer.write(sample)
+            if writer.total % 10000 == 0:
+                sys.stderr.write('%d samples, %.1fs\n'%(writer.total, 
+                    time.time() - t))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+    print('%d samples in %d shards (%s) %.1fs'%(writer.total, 
+        len(writer.files), opts.output, time.time() - t))
     return 0
 
 
@@ -913,6 +5217,179 @@ if __name__ == '__main__':
         print(b)
         print(score, t)
         print(chr(ord('A') + row) + chr(ord('A') + col))
+    def test8():
+        positions = [
+            '2:DF 1:EG 2:FG 1:FH 2:FJ 2:GG 1:GH 1:GI 2:HG 1:HH 1:IG 2:IH 1:JF 2:JI 1:KE',
+            '1:HH 2:II 1:IH 2:GI 1:JH',
+            '1:HH 2:II 1:HI 2:IG 1:HG 2:HJ 1:IH',
+        ]
+        p = parallel()
+        serial, total, speedup = p.speedup(positions, 2, 4)
+        p.close()
+        print('serial %.3fs parallel %.3fs speed-up %.2fx'%(serial, total, speedup))
+        return 0
+    def test9():
+        b = chessboard()
+        b.loads('1:HH 2:II 1:HI 2:IG 1:HG 2:HJ 1:IH')
+        s = searcher()
+        s.board = b.board()
+        s.stats = statistics()
+        def progress(stats):
+            print('... %d nodes %.2fs'%(sum(stats.nodes), stats.elapsed()))
+        s.progress = progress
+        s.interval = 0.5
+        print(s.search(2, 4, timeout = 10))
+        print(s.stats)
+        return 0
+    def test10():
+        import random
+        batch = batchevaluation()
+        fallback = batchevaluation()
+        fallback.numpy = None       # 没有安装 NumPy 时的路径
+        e = evaluation()
+        rand = random.Random(0)
+        boards, turns = [], []
+        for n in range(1000):
+            b = [ [ 0 for i in range(15) ] for j in range(15) ]
+            for k in range(rand.randint(1, 120)):
+                b[rand.randint(0, 14)][rand.randint(0, 14)] = rand.randint(1, 2)
+            boards.append(b)
+            turns.append(rand.randint(1, 2))
+        t = time.time()
+        expect = [ e.evaluate(b, turn) for b, turn in zip(boards, turns) ]
+        t1 = time.time() - t
+        failed = 0
+        for turn in (turns, 1):
+            scores = fallback.evaluate(boards, turn)
+            if isinstance(turn, int):
+                expect1 = [ e.evaluate(b, turn) for b in boards ]
+            else:
+                expect1 = expect
+            failed += len([ 1 for x, y in zip(expect1, scores) if x != y ])
+        failed += fallback.evaluate([], 1) != []
+        print('fallback mismatch %d'%failed)
+        if batch.numpy is None:
+            print('numpy is not installed')
+            return 0
+        t = time.time()
+        scores = batch.evaluate(boards, turns)
+        t2 = time.time() - t
+        failed = len([ 1 for x, y in zip(expect, scores) if x != y ])
+        failed += batch.evaluate([], 1) != []
+        print('mismatch %d scalar %.3fs batch %.3fs'%(failed, t1, t2))
+        return 0
+    def test11():
+        import random
+        for name in ruleset.NAMES:
+            b = chessboard(rules = name)
+            b.loads('1:HC 1:HD 1:HE 1:HF 1:HG 1:HH 2:IC 2:ID 2:IE 2:IF 2:IG')
+            print(name, 'overline:', b.check())
+        b = chessboard(rules = 'renju')
+        b.loads('1:HH 1:HI 1:IG 1:JG')
+        print('double three at HG:', b.rules.forbidden(b.board(), 7, 6))
+        rand = random.Random(0)
+        e, ref = evaluation(size = 19), evaluation(None, size = 19)
+        failed = 0
+        for n in range(200):
+            board = [ [ 0 for i in range(19) ] for j in range(19) ]
+            for k in range(rand.randint(1, 80)):
+                board[rand.randint(0, 18)][rand.randint(0, 18)] = \
+                        rand.randint(1, 2)
+            if e.evaluate(board, 1) != ref.evaluate(board, 1):
+                failed += 1
+        print('19x19 mismatch %d'%failed)
+        b = chessboard(size = 19)
+        b.loads('1:JJ 2:KK 1:JK')
+        s = searcher(19)
+        s.board = b.board()
+        print(s.search(2, 2))
+        return 0
+    def test12():
+        import random
+        rand = random.Random(0)
+        e = evaluation()
+        b = bitboard()
+        b.bind(None, incremental(e), candidate(2))
+        failed = 0
+        for n in range(2000):
+            if b.stack and (rand.random() < 0.4 or len(b.stack) > 60):
+                b.unmake_move()
+            else:
+                row, col = rand.randint(0, 14), rand.randint(0, 14)
+                if b[row][col] == 0:
+                    b.make_move(row, col, len(b.stack) % 2 + 1)
+            board = b.board()
+            if b.hash != b.zobrist.hash(board):
+                failed += 1
+            elif b.evaluator.evaluate(1) != e.evaluate(board, 1):
+                failed += 1
+            elif b.winner() != 0 and b.winner() != b.check():
+                failed += 1
+        cand = candidate(2)
+        cand.load(b.board())
+        print('failed %d, candidates %s'%(failed, cand.cells == b.candidate.cells))
+        # 绑定已有棋子的数组：读取和直线编码都要来自新的数组
+        board = [ [ 0 for n in range(15) ] for m in range(15) ]
+        board[7][7] = 1
+        b = bitboard()
+        b.bind(board)
+        b.make_move(7, 8, 2)
+        ref = bitboard()
+        ref.loads('1:HH 2:HI')
+        same = [ b[i][j] == board[i][j] for i in range(15) for j in range(15) ]
+        same += [ b.mask(k, stone) == ref.mask(k, stone) 
+                for k in range(len(b.codes)) for stone in (1, 2) ]
+        print('bind: reads %s, masks %s'%(all(same[:225]), all(same[225:])))
+        return 0
+    def test13():
+        # 恰好五子获胜：白棋在 HE 只能走成长连，不能当作五连
+        text = '2:HA 2:HB 2:HC 2:HD 2:HF 1:JJ 1:KK 1:LL 1:IJ 1:GG'
+        for name in ruleset.NAMES:
+            b = chessboard(rules = name)
+            b.loads(text)
+            s = searcher(rules = name)
+            s.board = [ list(row) for row in b.board() ]
+            score, row, col = s.search(2, 3)
+            b[row][col] = 2
+            print(name, score, row, col, 'win:', b.checkmove(row, col))
+            e = evaluation(rules = name)
+            b[row][col] = 0
+            b[7][4] = 2
+            print(name, 'overline HE:', e.evaluate(b.board(), 1))
+        return 0
+    def test14():
+        # 禁手：同一直线上的两个四，活三是否真的能走成活四
+        cases = (('1:HC 1:HE 1:HG 1:HI', 'HF', True),
+            ('1:HC 1:HD 1:HG 1:HI 1:HJ', 'HF', True),
+            ('1:HB 1:HC 1:HD 1:HH 1:HI 1:HJ', 'HF', True),
+            ('1:HE 1:HF 1:HG', 'HH', False),
+            ('1:HH 1:HI 1:IG 1:JG', 'HG', True),
+            ('1:HH 1:HI 1:IG 1:JG 2:HE 2:HK', 'HG', False),
+            ('1:HH 1:HI 1:IG 1:JG 1:DF 1:EF 1:FF 1:GF 1:IF 1:DJ 1:EJ '
+                '1:FJ 1:GJ 1:IJ', 'HG', False))
+        failed = 0
+        for text, move, expect in cases:
+            row, col = ord(move[0]) - ord('A'), ord(move[1]) - ord('A')
+            for b in (chessboard(rules = 'renju'), bitboard(rules = 'renju')):
+                b.loads(text)
+                if renju().forbidden(b, row, col) != expect:
+                    print('failed:', text, move)
+                    failed += 1
+        print('failed %d'%failed)
+        return 0
+    def test15():
+        # 直线棋型表：和逐个棋子分析的结果对比，保存以后重新加载
+        import os, tempfile
+        for name in ruleset.NAMES:
+            table = shared_linetable(name)
+            filename = os.path.join(tempfile.mkdtemp(), 'linetable.bin')
+            table.save(filename)
+            loaded = linetable(rules = name)
+            print(name, 'failed %d'%table.verify(), 'reload:',
+                    loaded.load(filename) and loaded.table == table.table)
+            os.remove(filename)
+            os.rmdir(os.path.dirname(filename))
+        return 0
     def test7():
         b = chessboard()
         s = searcher()
@@ -954,6 +5431,22 @@ if __name__ == '__main__':
                 return 0
         return 0
     #test6()
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batchmain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        sys.exit(benchmain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'book':
+        sys.exit(bookmain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        sys.exit(recordmain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'server':
+        sys.exit(servermain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'loadtest':
+        sys.exit(loadtestmain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'match':
+        sys.exit(matchmain(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'train':
+        sys.exit(trainmain(sys.argv[2:]))
     gamemain()
 
 